@@ -0,0 +1,5 @@
+#!/usr/bin/env pyrate
+
+use_toolchain('gcc', lto = 'full', lto_pool_depth = 3)
+lib = static_library('libexample14', 'foo.cpp')
+executable('example14.bin', ['test.cpp', lib])
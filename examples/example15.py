@@ -0,0 +1,5 @@
+#!/usr/bin/env pyrate
+
+use_toolchain('gcc', debug_info = 'split')
+default_context.basepath_object_file = 'obj'
+executable('example15.bin', 'test.cpp foo.cpp')
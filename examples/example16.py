@@ -0,0 +1,4 @@
+#!/usr/bin/env pyrate
+
+use_toolchain('gcc', linker = 'bfd')
+executable('example16.bin', 'test.cpp foo.cpp')
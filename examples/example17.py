@@ -0,0 +1,8 @@
+#!/usr/bin/env pyrate
+
+wx = find_external('wx', lazy = True) # never probed - no target uses it
+pthread = find_external('pthread', lazy = True)
+use_external('missing_lib', lazy = True)
+executable('example17.bin', ['test.cpp', 'foo.cpp', pthread])
+if find_external('missing_lib', lazy = True):
+	executable('example17_missing.bin', 'test.cpp')
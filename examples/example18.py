@@ -0,0 +1,5 @@
+#!/usr/bin/env pyrate
+
+use_toolchain('gcc', lto = True)
+lib = static_library('libexample18', 'foo.cpp')
+executable('example18.bin', ['test.cpp', lib])
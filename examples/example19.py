@@ -0,0 +1,5 @@
+#!/usr/bin/env pyrate
+
+lib = static_library('libexample19', 'foo.cpp', compiler_opts = '-O2')
+executable('example19.bin', ['test.cpp', lib])
+executable('example19_cpp11.bin', ['test_cpp11.cpp', 'foo.cpp', find_external('pthread')], compiler_opts = '-std=c++11')
@@ -0,0 +1,6 @@
+#!/usr/bin/env pyrate
+
+lib = static_library('libexample20', 'foo.cpp')
+executable('example20.bin', ['test.cpp', lib])
+if configuration == 'debug':
+	executable('example20_debug_only.bin', 'test.cpp', compiler_opts = '-DDEBUG_ONLY')
@@ -0,0 +1,10 @@
+#!/usr/bin/env pyrate
+
+use_toolchain('gcc', static_archive_mode = 'thin')
+lib = static_library('libexample21', 'foo.cpp')
+executable('example21.bin', ['test.cpp', lib])
+install(lib, destination = '/usr/local/lib')
+
+ctx = Context()
+ctx.tools['linker'] = find_external('link-gcc', static_archive_mode = 'incremental')
+ctx.static_library('libexample21_incremental', 'foo.cpp test.c')
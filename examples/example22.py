@@ -0,0 +1,12 @@
+#!/usr/bin/env pyrate
+
+pthread = find_external('pthread')
+ctx_a = Context(implicit_object_input = [macro('FEATURE_A')])
+ctx_a.executable('example22_a.bin', ['test.cpp', 'foo.cpp'])
+ctx_b = Context(implicit_object_input = [macro('FEATURE_B')])
+ctx_b.executable('example22_b.bin', ['test.cpp', 'foo.cpp'])
+executable('example22_c.bin', ['test.cpp', 'foo.cpp', pthread])
+executable('example22_d.bin', ['test.cpp', 'foo.cpp'], compiler_opts = '-O3')
+ctx_e = Context(implicit_object_input = [BuildSource(on_use_deps = {'compile_cpp': [InputFile('foo.h')]})])
+ctx_e.executable('example22_e.bin', ['test.cpp', 'foo.cpp'])
+executable('example22_f.bin', ['test.cpp', 'foo.cpp'])
@@ -0,0 +1,8 @@
+#!/usr/bin/env pyrate
+
+lib_shared = shared_library('libexample23', 'foo.cpp')
+lib_static = static_library('libexample23', 'foo.cpp')
+exe = executable('example23.bin', ['test.cpp', lib_static])
+install([exe, lib_shared], destination = '/opt/example23/bin', mode = 'compare', batch = True)
+install(lib_static, destination = '/opt/example23/lib', mode = 'hardlink')
+install(lib_shared, destination = '/opt/example23/lib')
@@ -0,0 +1,4 @@
+#!/usr/bin/env pyrate
+
+use_toolchain('gcc', modules = True)
+executable('example24.bin', 'modules/main.f90 modules/shapes.f90 modules/geometry.f90')
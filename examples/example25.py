@@ -0,0 +1,8 @@
+#!/usr/bin/env pyrate
+
+project_flags = [macro('EXAMPLE25_PROJECT_NAME=example25'), macro('EXAMPLE25_ENABLE_LOGGING'),
+	macro('EXAMPLE25_MAX_CONNECTIONS=256')]
+ctx = Context(implicit_object_input = project_flags)
+ctx.executable('example25_a.bin', ['test.cpp', 'foo.cpp'], compiler_opts = '-O2')
+ctx.executable('example25_b.bin', ['test.cpp', 'foo.cpp'], compiler_opts = '-O3')
+ctx.executable('example25_c.bin', ['test.cpp', 'foo.cpp'], compiler_opts = '-Os')
@@ -0,0 +1,9 @@
+#!/usr/bin/env pyrate
+
+shared_library('libexample26', 'foo.cpp', load_profile = True)
+shared_library('libexample26_now', 'foo.cpp', load_profile = 'bind_now')
+
+ctx = Context()
+ctx.tools['c'] = find_external('gcc', load_profile = 'default')
+ctx.tools['linker'] = find_external('link-gcc', load_profile = 'default')
+ctx.executable('example26.bin', 'test.c')
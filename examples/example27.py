@@ -0,0 +1,5 @@
+#!/usr/bin/env pyrate
+
+lib = static_library('libexample27', 'foo.cpp')
+exe = executable('example27.bin', ['test.cpp', lib])
+pgo(exe, ['$in > /dev/null', '$in --help > /dev/null'])
@@ -0,0 +1,5 @@
+#!/usr/bin/env pyrate
+
+exe = executable('example28.bin', ['test.cpp', 'foo.cpp'])
+test(exe, args = ['--verbose'], env = {'EXAMPLE_MODE': 'fast'}, data = ['foo.h'], timeout = 60)
+test(exe, name = 'example28_sharded', shards = 2)
@@ -0,0 +1,13 @@
+#!/usr/bin/env pyrate
+
+cpp = tools['cpp']
+opts = ['-O2']
+# the checks of a list are compiled concurrently
+(has_vector, has_missing) = cpp.has_header(['vector', 'pyrate_missing_header.h'])
+if has_vector and not has_missing:
+	opts.append('-DHAVE_VECTOR')
+if not cpp.supports_flag('-fpyrate-unknown-flag'):
+	opts.append('-DNO_UNKNOWN_FLAG')
+if cpp.compiles('int main() { return __builtin_expect(0, 0); }\n'):
+	opts.append('-DHAVE_BUILTIN_EXPECT')
+executable('example29.bin', ['test.cpp', 'foo.cpp'], compiler_opts = opts)
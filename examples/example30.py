@@ -0,0 +1,7 @@
+#!/usr/bin/env pyrate
+
+lib = shared_library('libExample30', ['foo.cpp'])
+exe = executable('example30.bin', ['test.cpp', lib])
+other = executable('example30_other.bin', ['test_cpp11.cpp'])
+test(exe)
+install([exe, lib])
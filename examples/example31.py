@@ -0,0 +1,4 @@
+#!/usr/bin/env pyrate
+
+lib = shared_library('libExample31', ['foo.cpp'])
+executable('example31.bin', ['test.cpp', lib])
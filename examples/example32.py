@@ -0,0 +1,5 @@
+#!/usr/bin/env pyrate
+
+use_toolchain('gcc', load_profile = 'default')
+lib = shared_library('libExample32', ['load_profile/value.cpp'])
+executable('example32.bin', ['load_profile/main.cpp', lib])
@@ -0,0 +1,8 @@
+#!/usr/bin/env pyrate
+
+build_output = ['makefile-compact']
+lib = static_library('libexampleM4', 'foo.cpp')
+ex_d = executable('exampleM4_debug.bin', ['test.cpp', lib], compiler_opts = '-O0')
+ex_r = executable('exampleM4_release.bin', ['test.cpp', lib], compiler_opts = '-O3')
+install(ex_r)
+default_targets = [ex_r, ex_d]
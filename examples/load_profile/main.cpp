@@ -0,0 +1,8 @@
+#include "value.h"
+#include <iostream>
+
+int main()
+{
+	std::cout << value(37) << std::endl;
+	return 0;
+}
@@ -0,0 +1,7 @@
+#include "value.h"
+#include <string>
+
+PYRATE_EXPORT int value(int x)
+{
+	return x + std::string("value").size();
+}
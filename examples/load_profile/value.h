@@ -0,0 +1,10 @@
+#ifndef VALUE_H
+#define VALUE_H
+
+#ifndef PYRATE_EXPORT
+#define PYRATE_EXPORT
+#endif
+
+PYRATE_EXPORT int value(int x);
+
+#endif
@@ -0,0 +1,9 @@
+module geometry
+  implicit none
+  real, parameter :: pi = 3.14159265
+contains
+  real function circle_area(radius)
+    real, intent(in) :: radius
+    circle_area = pi * radius ** 2
+  end function circle_area
+end module geometry
@@ -0,0 +1,7 @@
+program main
+  use, intrinsic :: iso_fortran_env, only: output_unit
+  use shapes
+  implicit none
+  call print_circle(2.0)
+  flush(output_unit)
+end program main
@@ -0,0 +1,9 @@
+module shapes
+  use geometry, only: circle_area
+  implicit none
+contains
+  subroutine print_circle(radius)
+    real, intent(in) :: radius
+    print *, 'area of circle:', circle_area(radius)
+  end subroutine print_circle
+end module shapes
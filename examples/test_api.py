@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# generate several build files concurrently in memory (from another working directory)
+import os, sys, threading
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pyrate
+
+examples = ['example01', 'example02', 'example03', 'example05', 'example05_compat', 'example06', 'example20', 'project1/build']
+basedir = os.path.dirname(os.path.abspath(__file__))
+os.chdir('/')
+results = {}
+
+def run(idx, name):
+	kwargs = {}
+	if name == 'example20':
+		kwargs['configurations'] = 'debug,release'
+	if name == 'example05_compat': # the hash mode is selected for each generation
+		kwargs['hash_mode'] = 'compat'
+	results[idx] = pyrate.generate(os.path.join(basedir, name.replace('_compat', '') + '.py'), **kwargs)['ninja']
+
+threads = []
+for (idx, name) in enumerate(examples * 3):
+	threads.append(threading.Thread(target = run, args = (idx, name)))
+	threads[-1].start()
+for thread in threads:
+	thread.join()
+for (idx, name) in enumerate(examples * 3):
+	if results[idx] != open(os.path.join(basedir, name + '.ninja')).read():
+		sys.stderr.write('%s: in memory build file differs\n' % name)
+		sys.exit(1)
+if os.getcwd() != '/':
+	sys.stderr.write('working directory was changed\n')
+	sys.exit(1)
@@ -65,12 +65,14 @@ run_test_general() {
 $EXEC --version
 TESTS="../examples/example01.py example01.py example02.py example03.py example04.py example05.py"
 TESTS="$TESTS example06.py example07.py example08.py example09.py example10.py example11.py"
-TESTS="$TESTS example12.py example13.py"
+TESTS="$TESTS example12.py example13.py example14.py example15.py example16.py example17.py"
+TESTS="$TESTS example21.py example23.py example25.py example26.py example27.py example28.py"
+TESTS="$TESTS example32.py"
 for EXAMPLE in $TESTS; do
 	run_test $EXAMPLE
 done
 
-for EXAMPLE in exampleM1.py exampleM2.py exampleM3.py; do
+for EXAMPLE in exampleM1.py exampleM2.py exampleM3.py exampleM4.py; do
 	run_test_make $EXAMPLE
 done
 
@@ -78,6 +80,69 @@ for EXAMPLE in exampleG1.py exampleG2.py; do
 	run_test_general $EXAMPLE
 done
 
+$EXEC --hash-compat example05.py --output example05.ninja.test
+diff -u example05_compat.ninja example05.ninja.test
+rm example05.ninja.test
+
+PYRATE_CMD=pyrate $EXEC --rusage example18.py --output example18.ninja.test
+diff -u example18.ninja example18.ninja.test
+cp example18.ninja_log .ninja_log
+cp example18.rusage .pyrate_rusage
+$EXEC --report example18.py > example18.report.test
+diff -u example18.report example18.report.test
+PYRATE_CMD=pyrate $EXEC --rusage example18.py --output example18.ninja.test
+grep -A 1 "pool link_lto" example18.ninja.test | grep -q "depth = 1"
+rm example18.ninja.test example18.report.test .ninja_log .pyrate_rusage .pyrate_pools
+
+$EXEC --shards 2 example19.py --output example19.ninja.test
+diff -u example19.ninja example19.ninja.test
+for STAGE in shard1 shard2 merge; do
+	diff -u example19.$STAGE.ninja example19.ninja.$STAGE.ninja
+	rm example19.ninja.$STAGE.ninja
+done
+rm example19.ninja.test
+
+$EXEC --configurations debug,release example20.py --output example20.ninja.test
+diff -u example20.ninja example20.ninja.test
+rm example20.ninja.test
+
+$EXEC --factor-sources example22.py --output example22.ninja.test
+diff -u example22.ninja example22.ninja.test
+$EXEC --redundant-sources example22.py > example22.report.test
+diff -u example22.report example22.report.test
+rm example22.ninja.test example22.report.test
+
+PYRATE_CMD=pyrate $EXEC example24.py --output example24.ninja.test
+diff -u example24.ninja example24.ninja.test
+for SRC in main shapes geometry; do
+	$EXEC -t scan-fortran modules/$SRC.f90 $SRC.o.ddi modules/$SRC.o
+done
+$EXEC -t collate-modules example24.dd.test '%s.mod' main.o.ddi shapes.o.ddi geometry.o.ddi
+diff -u example24.dd example24.dd.test
+rm example24.ninja.test example24.dd.test *.o.ddi
+
+rm -f .pyrate_checks
+$EXEC example29.py --output example29.ninja.test
+diff -u example29.ninja example29.ninja.test
+test $(grep -c '": \(true\|false\)' .pyrate_checks) = 4
+$EXEC example29.py --output example29.ninja.test
+diff -u example29.ninja example29.ninja.test
+rm example29.ninja.test .pyrate_checks
+
+$EXEC example30.py --output example30.ninja.test --affected foo.cpp > example30.affected.test
+diff -u example30.ninja example30.ninja.test
+diff -u example30.affected example30.affected.test
+printf 'test.o: test.cpp foo.h \\\n /usr/include/stdio.h\n' > test.o.d
+$EXEC example30.py --output example30.ninja.test --affected foo.h,test_cpp11.cpp > example30.affected.test
+diff -u example30_deps.affected example30.affected.test
+rm example30.ninja.test example30.affected.test test.o.d
+
+PYRATE_CMD=pyrate $EXEC example31.py --output example31.ninja.test --artifact-cache cache --artifact-cache-size 1G
+diff -u example31.ninja example31.ninja.test
+rm example31.ninja.test
+
+${1:-python} test_api.py
+
 for EXAMPLE in project1/build.py project1/foo/build.py; do
 	run_project $EXAMPLE
 done
@@ -117,6 +182,41 @@ for EXAMPLE in $TESTS; do
 	run_test $EXAMPLE
 done
 
+if [ -n "$(which ninja 2> /dev/null)" ]; then # executable linked against a load profiled library
+	ninja -f example32.ninja
+	test "$(./example32.bin)" = "42"
+	ninja -f example32.ninja -t clean
+	rm -f .ninja_log .ninja_deps
+fi
+
+if [ -n "$(which ninja 2> /dev/null)" ]; then # shards running concurrently in the same directory
+	ninja -f example19.shard1.ninja & SHARD1=$!
+	ninja -f example19.shard2.ninja & SHARD2=$!
+	wait $SHARD1
+	wait $SHARD2
+	ninja -f example19.merge.ninja
+	./example19.bin > /dev/null
+	ninja -f example19.ninja -t clean
+	rm -rf .ninja_log .ninja_deps .ninja_shard1 .ninja_shard2
+fi
+
+if [ -n "$(which ninja 2> /dev/null)" ]; then # outputs of a clean build are restored from the artifact cache
+	$EXEC example31.py --output example31.cache.ninja --artifact-cache .artifact_cache
+	ninja -f example31.cache.ninja
+	mkdir .artifact_cache_first
+	cp foo.o test.o libExample31.so example31.bin .artifact_cache_first
+	ninja -f example31.cache.ninja -t clean
+	ninja -f example31.cache.ninja
+	for FN in foo.o test.o libExample31.so example31.bin; do
+		cmp $FN .artifact_cache_first/$FN
+	done
+	$EXEC -t cache-stats .artifact_cache > example31.cache.stats
+	grep -q "^hits: *4$" example31.cache.stats
+	grep -q "^misses: *4$" example31.cache.stats
+	ninja -f example31.cache.ninja -t clean
+	rm -rf .ninja_log .ninja_deps .artifact_cache .artifact_cache_first example31.cache.ninja example31.cache.stats
+fi
+
 if [ -n "$(which coverage 2> /dev/null)" ]; then
 	mv .coverage ..
 fi
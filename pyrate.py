@@ -15,22 +15,88 @@
 
 __version__ = '0.2.11'
 
-import os, sys
+import os, re, sys, threading
+try:
+	from StringIO import StringIO
+except ImportError:
+	from io import StringIO
 try:
 	if os.environ.get('TESTOLDIMPORTS'):
 		raise ImportError()
 	import hashlib
-	def calc_hash(value):
-		return hashlib.md5(repr(value).encode('ascii')).hexdigest()
+	new_hash = hashlib.md5
 except ImportError:
-	def calc_hash(value):
-		return __import__('md5').md5(repr(value)).hexdigest()
+	new_hash = __import__('md5').md5
+
+if sys.version_info[0] < 3:
+	(text_types, int_types) = ((str, unicode), (int, long))
+else:
+	(text_types, int_types) = ((str,), (int,))
+
+
+def encode_text(value):
+	if isinstance(value, bytes): # python 2 str
+		return value
+	return value.encode('utf-8')
+
+
+def calc_hash_repr(value):
+	return new_hash(encode_text(repr(value))).hexdigest()
+
+
+def update_hash(hash_obj, value):
+	# feed a canonical, typed representation of value to the hash
+	value_type = type(value)
+	if value_type in text_types:
+		data = encode_text(value)
+		hash_obj.update(encode_text('S%d:' % len(data)))
+		hash_obj.update(data)
+	elif (value_type is list) or (value_type is tuple):
+		hash_obj.update(encode_text('L%d:' % len(value)))
+		for entry in value:
+			update_hash(hash_obj, entry)
+	elif value_type is dict:
+		hash_obj.update(encode_text('D%d:' % len(value)))
+		for key in sorted(value, key = repr):
+			update_hash(hash_obj, key)
+			update_hash(hash_obj, value[key])
+	elif value_type in int_types:
+		hash_obj.update(encode_text('V%d;' % value))
+	elif (value is None) or (value_type is bool):
+		hash_obj.update(encode_text('V%r;' % value))
+	else:
+		hash_obj.update(encode_text('R'))
+		update_hash(hash_obj, repr(value))
+
+
+def calc_hash_structural(value):
+	hash_obj = new_hash()
+	update_hash(hash_obj, value)
+	return hash_obj.hexdigest()
+
+
+# calc_hash_key is used for the keys of composite hashes - the structural hash encodes them directly
+hash_modes = {'structural': (calc_hash_structural, lambda value: value), 'compat': (calc_hash_repr, calc_hash_repr)}
+
+
+def get_hash_mode(mode):
+	if mode not in hash_modes:
+		raise Exception('Unknown hash mode %s - available modes: %s' % (repr(mode), str.join(', ', sorted(hash_modes))))
+	return mode
+
+
+def calc_hash(value): # the hash mode is selected by the session running in the current thread
+	return hash_modes[getattr(generation_state, 'hash_mode', 'structural')][0](value)
+
+
+def calc_hash_key(value):
+	return hash_modes[getattr(generation_state, 'hash_mode', 'structural')][1](value)
 
 
 def ensure_list(value):
 	if isinstance(value, (list, tuple)):
 		return list(value)
-	elif value:
+	elif isinstance(value, BuildSource) or value: # avoid probing lazy externals
 		return [value]
 
 
@@ -38,25 +104,65 @@ class ProcessError(Exception):
 	pass
 
 
+class GenerationCache(object):
+	# state shared between build file generations (watch mode, configurations)
+	def __init__(self):
+		(self.processes, self.listings) = ({}, {})
+		(self.build_files, self.dirs, self.outputs) = (set(), set(), set())
+		(self.linkers, self.checks) = ({}, {}) # probed linkers, compiler check results by cache file
+
+# the generation cache is selected by the session running in the current thread
+generation_state = threading.local()
+
+
+def get_generation_cache():
+	return getattr(generation_state, 'cache', None)
+
+
 def run_process(args):
+	generation_cache = get_generation_cache()
+	if generation_cache is not None:
+		key = tuple(args)
+		if key not in generation_cache.processes:
+			try:
+				generation_cache.processes[key] = (_run_process(args), None)
+			except ProcessError as ex:
+				generation_cache.processes[key] = (None, ex)
+		(result, ex) = generation_cache.processes[key]
+		if ex is not None:
+			raise ex
+		return result
+	return _run_process(args)
+
+
+def _run_process(args):
 	import subprocess
 	try:
 		p = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-		ret = p.wait()
+		(stdout, stderr) = p.communicate() # waiting before reading the pipes blocks on large outputs
 	except Exception:
 		raise ProcessError('Unable to run process %s' % repr(args))
-	if ret != 0:
-		raise ProcessError('Process %r exit code %d' % (args, ret))
-	(stdout, stderr) = p.communicate()
+	if p.returncode != 0:
+		raise ProcessError('Process %r exit code %d' % (args, p.returncode))
 	return (stdout.decode('utf-8').strip(), stderr.decode('utf-8').strip())
 
 
+def get_attributes(ref):
+	result = dict(getattr(ref, '__dict__', {}))
+	for cls in ref.__class__.__mro__:
+		for key in getattr(cls, '__slots__', []):
+			if hasattr(ref, key):
+				result[key] = getattr(ref, key)
+	return result
+
+
 def nice_repr(ref, keylen, delim = '   '):
 	def indent_repr(value, prefix = delim):
 		return str.join('\n', map(lambda x: prefix + x, repr(value).splitlines()))
 	result = []
-	for key in sorted(ref.__dict__, reverse = True):
-		value = ref.__dict__[key]
+	attributes = get_attributes(ref)
+	for key in sorted(attributes, reverse = True):
+		value = attributes[key]
 		if isinstance(value, list) and value:
 			result.append(delim + '%s = [\n' % key.ljust(keylen) + str.join(',\n', map(lambda entry: '%s' % indent_repr(entry, 2 * delim), value)) + ']')
 		else:
@@ -64,14 +170,27 @@ def nice_repr(ref, keylen, delim = '   '):
 	return '%s(\n%s)' % (ref.__class__.__name__, str.join('\n', result))
 
 
+def list_dir(dn):
+	generation_cache = get_generation_cache()
+	if generation_cache is None:
+		return os.listdir(dn)
+	dn = os.path.abspath(dn)
+	if dn not in generation_cache.listings:
+		generation_cache.listings[dn] = os.listdir(dn)
+	return generation_cache.listings[dn]
+
+
 def match(value, dn, recurse):
 	import fnmatch
+	generation_cache = get_generation_cache()
 	result = []
 	if recurse:
 		walk_entries = os.walk(dn)
 	else:
-		walk_entries = [(dn, [], os.listdir(dn))]
+		walk_entries = [(dn, [], list_dir(dn))]
 	for walk_result in walk_entries:
+		if generation_cache is not None:
+			generation_cache.dirs.add(os.path.abspath(walk_result[0]))
 		for fn in walk_result[2]:
 			fn = os.path.relpath(os.path.join(walk_result[0], fn), dn)
 			accept = False
@@ -101,22 +220,35 @@ class SelfReference(object):
 	def __init__(self, ref = None):
 		self._ref = ref
 
+# shared (and never modified) empty values for the on_use dictionaries
+empty_on_use = {}
+
 
 class Rule(object):
+	__slots__ = ('name', 'cmd', 'desc', 'defaults', 'params', 'implicit_output_exts',
+		'connection', 'target_on_use_inputs', 'target_on_use_deps', 'target_on_use_variables', 'module_rules')
+
 	def __init__(self, connection, name, cmd, desc, defaults,
-			target_on_use_inputs = None, target_on_use_deps = None, target_on_use_variables = None, **kwargs):
+			target_on_use_inputs = None, target_on_use_deps = None, target_on_use_variables = None,
+			implicit_output_exts = None, module_rules = None, **kwargs):
 		# persistent values
 		(self.name, self.cmd, self.desc, self.defaults, self.params) = (name, cmd, desc, defaults, sorted(kwargs.items()))
+		self.implicit_output_exts = tuple(implicit_output_exts or []) # eg. ['.dwo'] to declare foo.dwo for foo.o
 		# transient values used to help build system
 		(self.connection, self.target_on_use_inputs, self.target_on_use_deps, self.target_on_use_variables) =\
 			(connection, target_on_use_inputs, target_on_use_deps, target_on_use_variables)
+		self.module_rules = module_rules # (scan rule, collation rule) of compile rules with module dependencies
 
 	def get_hash(self):
-		return calc_hash([self.name, self.cmd, self.desc, sorted(self.defaults.items()), self.params])
+		hash_list = [self.name, self.cmd, self.desc, sorted(self.defaults.items()), self.params]
+		if self.implicit_output_exts:
+			hash_list.append(list(self.implicit_output_exts))
+		return calc_hash(hash_list)
 
 	def clone(self):
 		return Rule(self.connection, self.name, self.cmd, self.desc, self.defaults,
-			self.target_on_use_inputs, self.target_on_use_deps, self.target_on_use_variables, **dict(self.params))
+			self.target_on_use_inputs, self.target_on_use_deps, self.target_on_use_variables,
+			self.implicit_output_exts, self.module_rules, **dict(self.params))
 
 	def __str__(self):
 		return nice_repr(self, 8)
@@ -126,14 +258,37 @@ class Rule(object):
 
 phony_rule = Rule((None, None), 'phony', '', '', {})
 
+
+class Pool(object):
+	default_depth = 2
+
+	def __init__(self, name, depth = None):
+		(self.name, self.depth) = (name, depth)
+
+	def get_depth(self, measured_depths):
+		if self.depth == 'auto': # use depth derived from the last build report
+			return measured_depths.get(self.name, Pool.default_depth)
+		return self.depth
+
+	def __str__(self):
+		return self.name
+
+	def __repr__(self):
+		return '%s(%s, %s)' % (self.__class__.__name__, repr(self.name), repr(self.depth))
+
 class BuildSource(object):
+	__slots__ = ('on_use_inputs', 'on_use_deps', 'on_use_variables')
+
 	def __init__(self, on_use_inputs = None, on_use_deps = None, on_use_variables = None):
 		self.on_use_inputs = self._resolve_self(on_use_inputs)
 		self.on_use_deps = self._resolve_self(on_use_deps)
-		self.on_use_variables = dict(on_use_variables or {})
+		self.on_use_variables = empty_on_use
+		if on_use_variables:
+			self.on_use_variables = dict(on_use_variables)
 
 	def _resolve_self(self, on_use_dict):
-		on_use_dict = on_use_dict or {}
+		if not on_use_dict:
+			return empty_on_use
 		result = {}
 		for key, value_list in on_use_dict.items():
 			for value in value_list:
@@ -146,10 +301,10 @@ class BuildSource(object):
 		def get_dict_keys(src):
 			result = []
 			for key, value_list in sorted(src.items()):
-				result.append(calc_hash(key))
+				result.append(calc_hash_key(key))
 				for value in value_list:
 					if value == self:
-						result.append(calc_hash(0))
+						result.append(calc_hash_key(0))
 					else:
 						result.append(value.get_hash())
 			return result
@@ -161,16 +316,25 @@ class BuildSource(object):
 
 
 class InputFile(BuildSource):
+	__slots__ = ('name', '_hash')
+
 	def __init__(self, name, rule_list = None):
-		self.name = name
+		(self.name, self._hash) = (name, None)
 		rule_list = ensure_list(rule_list or [None])
 		BuildSource.__init__(self, on_use_inputs = dict.fromkeys(rule_list, [self]))
 
+	def get_hash(self):
+		if self._hash is None:
+			self._hash = BuildSource.get_hash(self)
+		return self._hash
+
 	def __repr__(self):
 		return '%s(name = %s, on_use_inputs = {None: [self]})' % (self.__class__.__name__, repr(self.name))
 
 
 class TargetAlias(BuildSource):
+	__slots__ = ('target',)
+
 	def __init__(self, target):
 		self.target = target
 		BuildSource.__init__(self, on_use_inputs = {None: [target]})
@@ -180,31 +344,43 @@ class TargetAlias(BuildSource):
 
 
 class RuleVariables(BuildSource):
+	__slots__ = ('_hash',)
+
 	def __init__(self, on_use_variables):
+		self._hash = None
 		BuildSource.__init__(self, on_use_variables = on_use_variables)
 
+	def get_hash(self):
+		if self._hash is None:
+			self._hash = BuildSource.get_hash(self)
+		return self._hash
+
 	def __repr__(self):
 		return '%s(%s)' % (self.__class__.__name__, self.on_use_variables)
 
 
-def add_rule_vars(**kwargs):
+def add_rule_vars(registry, **kwargs):
 	variables = {}
 	for key, value in kwargs.items():
 		if value:
 			variables.setdefault(key, []).extend(ensure_list(value))
 	if variables:
-		return [RuleVariables(on_use_variables = {None: variables})]
+		return [registry.get_rule_variables({None: variables})]
 	return []
 
 
 class BuildTarget(BuildSource):
+	__slots__ = ('name', 'install_name', 'user_name', 'build_rule', 'build_src',
+		'target_type', 'no_rename', 'implicit_outputs', '_drop_opt')
+
 	def __init__(self, build_name, build_rule, build_src,
 			on_use_inputs = None, on_use_deps = None, on_use_variables = None,
-			target_type = None, no_rename = False, install_name = None, user_name = None):
+			target_type = None, no_rename = False, install_name = None, user_name = None, implicit_outputs = None):
 		BuildSource.__init__(self, on_use_inputs, on_use_deps, on_use_variables)
 		(self.name, self.install_name, self.user_name) = (build_name, install_name, user_name)
 		(self.build_rule, self.build_src) = (build_rule, build_src)
 		(self.target_type, self.no_rename) = (target_type, no_rename)
+		self.implicit_outputs = list(implicit_outputs or []) # in addition to the outputs declared by the rule
 		self._drop_opt = False
 
 	def get_hash(self):
@@ -233,10 +409,15 @@ class BuildTarget(BuildSource):
 	def get_build_deps(self):
 		return self._get_build(lambda e: e.on_use_deps, list, list.extend)
 
+	def get_implicit_outputs(self):
+		return list(map(lambda ext: get_normed_name(self.name, ext), self.build_rule.implicit_output_exts)) +\
+			self.implicit_outputs
+
 	def drop_build_opt(self):
 		self._drop_opt = True
 
-	def get_build_variables(self):
+	def get_build_variable_fragments(self):
+		# returns the values that are joined to form each build variable
 		def combine_variables(result, variables):
 			for key, values in variables.items():
 				for value in (values or []):
@@ -248,12 +429,19 @@ class BuildTarget(BuildSource):
 			result.pop('opts', None)
 		for key in sorted(result):
 			values = result.pop(key)
-			tmp = ''
+			(tmp, fragments) = ('', [])
 			for value in values:
 				if value not in tmp:
 					tmp += ' ' + value
-			if tmp:
-				result[key] = tmp.strip()
+					fragments.append(value)
+			if tmp.strip():
+				result[key] = fragments
+		return result
+
+	def get_build_variables(self):
+		result = self.get_build_variable_fragments()
+		for key in result:
+			result[key] = (' ' + str.join(' ', result[key])).strip()
 		return result
 
 	def __repr__(self):
@@ -265,18 +453,43 @@ def get_normed_name(fn, forced_ext):
 
 
 class Registry(object):
-	def __init__(self):
+	def __init__(self, basedir = None):
+		self.basedir = basedir or os.getcwd() # relative paths of the build files refer to this directory
 		self.target_list = []
+		(self.targets, self.install_targets) = ([], [])
+		self.pgo_targets = [] # optimized targets of the profile guided optimization
+		self.test_targets = []
+		self.install_batches = [] # (stamp target, [(target alias, install name, install rule)])
 		self.rename_all_targets = False
 		self.rename_all_constants = False
 		self.rename_all_rules = False
 		self.fold_target_opts = True
+		self.configuration = None # configuration that is currently evaluated
+		# identical input files and rule variables share a single instance (and its cached hash)
+		self._input_file_pool = {}
+		self._rule_variables_pool = {}
+
+	def get_path(self, fn):
+		return os.path.normpath(os.path.join(self.basedir, fn))
 
 	def register_target(self, target):
 		assert(isinstance(target, BuildTarget))
 		self.target_list.append(target)
 		return target
 
+	def get_input_file(self, name, rule_list = None):
+		rule_list = ensure_list(rule_list or [None])
+		key = (os.path.normpath(name), tuple(rule_list))
+		if key not in self._input_file_pool:
+			self._input_file_pool[key] = InputFile(name, rule_list = rule_list)
+		return self._input_file_pool[key]
+
+	def get_rule_variables(self, on_use_variables):
+		key = repr(sorted(map(lambda item: (item[0], sorted(item[1].items())), on_use_variables.items())))
+		if key not in self._rule_variables_pool:
+			self._rule_variables_pool[key] = RuleVariables(on_use_variables)
+		return self._rule_variables_pool[key]
+
 	def _collect_target_infos(self):
 		# collect information about target infos
 		# and deduplicate targets in target_list (and recursively in build_src) based on hash
@@ -330,6 +543,24 @@ class Registry(object):
 		thashs_by_name.clear()
 		thashs_no_rename.clear()
 
+	def _split_install_batches(self, target_order):
+		# a batch installs the files under the name of their build target - (renamed) targets
+		# with a different name are installed one by one
+		known_targets = set(target_order)
+		for (stamp, entries) in filter(lambda batch: batch[0] in known_targets, self.install_batches):
+			split_targets = []
+			for (alias, install_name, rule) in entries:
+				if os.path.basename(alias.target.name) == os.path.basename(install_name):
+					continue
+				split_targets.append(BuildTarget(install_name, rule, [alias]))
+				stamp.build_src.remove(alias)
+				stamp.implicit_outputs.remove(install_name)
+			target_order.extend(split_targets)
+			if not stamp.get_build_inputs():
+				(stamp.build_rule, stamp.build_src) = (phony_rule, list(map(TargetAlias, split_targets)))
+			elif split_targets:
+				stamp.build_src.append(BuildSource(on_use_deps = {None: split_targets}))
+
 	def _fold_target_opts(self, targets_by_topts_by_rhash):
 		# identify rules with a fixed set of parameters to fold them into the rule definition
 		for targets_by_topts in targets_by_topts_by_rhash.values():
@@ -361,6 +592,15 @@ class Registry(object):
 			for key, value in known_rule.defaults.items():
 				rules_by_rvalues_by_rkeys.setdefault(key, {}).setdefault(value, set()).add(known_rule)
 
+		depths_by_pool = {} # a pool is only written once - so all rules have to agree on its depth
+		for rule in rule_order:
+			for (key, value) in rule.params:
+				if isinstance(value, Pool):
+					depths_by_pool.setdefault(value.name, set()).add(value.depth)
+		for (pool_name, depths) in sorted(depths_by_pool.items()):
+			if len(depths) > 1:
+				raise Exception('Pool %s is requested with different depths: %s' % (pool_name,
+					str.join(', ', sorted(map(str, depths)))))
 		self._rename_rule_constants(rules_by_rvalues_by_rkeys)
 		self._rename_rule_names(rule_order)
 		return rule_order
@@ -393,15 +633,55 @@ class Registry(object):
 		(target_by_thash, thashs_by_name, thashs_no_rename, targets_by_topts_by_rhash, target_order) =\
 			self._collect_target_infos()
 		self._rename_targets(target_by_thash, thashs_by_name, thashs_no_rename)
+		self._split_install_batches(target_order)
 		self._fold_target_opts(targets_by_topts_by_rhash)
 		rule_order = self._process_rules(target_order)
 		return (sorted(rule_order, key = lambda r: r.name), target_order)
 
 
-class Context(object):
-	targets = []
-	install_targets = []
+class Configuration(object):
+	def __init__(self, name, compiler_opts = None, linker_opts = None):
+		(self.name, self.compiler_opts, self.linker_opts) = (name, compiler_opts, linker_opts)
+
+	def get_implicit_input(self, registry):
+		variables = {}
+		if self.compiler_opts:
+			variables['compile_'] = {'opts': ensure_list(self.compiler_opts)}
+		if self.linker_opts:
+			variables['link_exe'] = {'opts': ensure_list(self.linker_opts)}
+			variables['link_shared'] = {'opts': ensure_list(self.linker_opts)}
+		if variables:
+			return [registry.get_rule_variables(variables)]
+		return []
+
+	def __repr__(self):
+		return '%s(%s)' % (self.__class__.__name__, repr(self.name))
+
+build_configurations = {
+	'debug': Configuration('debug', compiler_opts = '-O0 -g'),
+	'release': Configuration('release', compiler_opts = '-O2 -DNDEBUG'),
+	'relwithdebinfo': Configuration('relwithdebinfo', compiler_opts = '-O2 -g -DNDEBUG'),
+	'asan': Configuration('asan', compiler_opts = '-O1 -g -fsanitize=address -fno-omit-frame-pointer',
+		linker_opts = '-fsanitize=address'),
+	'ubsan': Configuration('ubsan', compiler_opts = '-O1 -g -fsanitize=undefined', linker_opts = '-fsanitize=undefined'),
+}
+
 
+def get_configurations(configurations):
+	result = []
+	if isinstance(configurations, str):
+		configurations = configurations.replace(',', ' ').split()
+	for config in ensure_list(configurations):
+		if not isinstance(config, Configuration):
+			if config not in build_configurations:
+				raise Exception('Unknown configuration %s - available configurations: %s' %
+					(repr(config), str.join(', ', sorted(build_configurations))))
+			config = build_configurations[config]
+		result.append(config)
+	return result
+
+
+class Context(object):
 	def __init__(self, registry, platform, tools, prefix, prefix_mode, # pylint:disable=too-many-locals
 			implicit_input = None,
 			implicit_object_input = None,
@@ -412,7 +692,8 @@ class Context(object):
 			basepath_object_file = None,
 			basepath_static_library = None,
 			basepath_shared_library = None,
-			basepath_executable = None):
+			basepath_executable = None,
+			install_mode = None):
 		# set parameters that are not available to user in constructor
 		self._set_fixed(registry, platform, tools, prefix, prefix_mode)
 		self.basepath = basepath
@@ -425,6 +706,7 @@ class Context(object):
 		self.implicit_static_library_input = implicit_static_library_input
 		self.implicit_shared_library_input = implicit_shared_library_input
 		self.implicit_executable_input = implicit_executable_input
+		self.install_mode = install_mode
 
 	def _set_fixed(self, registry, platform, tools, prefix, prefix_mode):
 		(self.registry, self.platform) = (registry, platform)
@@ -433,7 +715,7 @@ class Context(object):
 		self._tracker = []
 
 	def match(self, value, dn = '.', recurse = False):
-		return match(value = value, dn = os.path.join(self.prefix, dn), recurse = recurse)
+		return match(value = value, dn = self.registry.get_path(os.path.join(self.prefix, dn)), recurse = recurse)
 
 	def match_libs(self, dn = '.', recurse = False, lib_types = None):
 		result = []
@@ -445,19 +727,25 @@ class Context(object):
 					result.append(self.static_library(os.path.join(dn, fn)))
 		return result
 
-	def get_basepath(self, basepath):
+	def get_basepath(self, basepath, shared = False):
 		def pathjoin(value):
 			if self.prefix_mode and (self.prefix_mode.lower() == 'front'):
 				return os.path.join(self.prefix, value)
 			return os.path.join(value, self.prefix)
+		result = self.prefix
 		if basepath:
-			return pathjoin(basepath)
+			result = pathjoin(basepath)
 		elif self.basepath:
-			return pathjoin(self.basepath)
-		return self.prefix
+			result = pathjoin(self.basepath)
+		if self.registry.configuration and not shared: # shared outputs are renamed if necessary
+			result = os.path.join(self.registry.configuration.name, result)
+		return result
 
 	def get_implicit_input(self, implicit_input):
-		return (implicit_input or []) + (self.implicit_input or [])
+		result = (implicit_input or []) + (self.implicit_input or [])
+		if self.registry.configuration:
+			result = result + self.registry.configuration.get_implicit_input(self.registry)
+		return result
 
 	def find_toolchain(self, name, *args, **kwargs):
 		name = name.lower()
@@ -473,7 +761,7 @@ class Context(object):
 
 	def find_internal(self, name):
 		result = set()
-		for obj in Context.targets + self.registry.target_list:
+		for obj in self.registry.targets + self.registry.target_list:
 			if name in [obj.name, obj.install_name, obj.user_name]:
 				result.add(obj)
 		if len(result) == 1:
@@ -483,6 +771,8 @@ class Context(object):
 
 	def find_external(self, name, *args, **kwargs):
 		name = name.lower()
+		if kwargs.pop('lazy', False):
+			return LazyExternal(self, name, args, kwargs, optional = kwargs.pop('optional', False))
 		version_parser = kwargs.pop('version_parser', None)
 		if name not in External.available and not define_pkg_config_external(name, version_parser):
 			sys.stderr.write('Unknown external %r\n' % name)
@@ -495,8 +785,11 @@ class Context(object):
 			sys.stderr.write('VersionError(%s): %s\n' % (name, e.args[0]))
 
 	def use_external(self, name, *args, **kwargs):
+		lazy = kwargs.get('lazy', False)
+		if lazy: # missing lazy externals are silently ignored during target resolution
+			kwargs['optional'] = True
 		ext = self.find_external(name, *args, **kwargs)
-		if ext:
+		if lazy or ext:
 			self.implicit_input = (self.implicit_input or [])
 			self.implicit_input.append(ext)
 
@@ -551,7 +844,7 @@ class Context(object):
 			input_list.extend(ensure_list(entry))
 		def translate_str(value):
 			if isinstance(value, str):
-				return InputFile(os.path.join(self.prefix, value))
+				return self.registry.get_input_file(os.path.join(self.prefix, value))
 			return value
 		return list(map(translate_str, input_list))
 
@@ -563,7 +856,7 @@ class Context(object):
 
 	def _get_link_input_list(self, build_name, input_list, implicit_input_list, link_mode,
 			linker_opts = None, compiler_opts = None):
-		for obj in (implicit_input_list + add_rule_vars(opts = linker_opts)):
+		for obj in (implicit_input_list + add_rule_vars(self.registry, opts = linker_opts)):
 			yield obj
 		for idx, obj in enumerate(input_list):
 			source_target_type = self.find_target_type(obj)
@@ -578,7 +871,7 @@ class Context(object):
 					yield self.object_file(os.path.relpath(obj.name, self.prefix),
 						compiler_opts = compiler_opts, input_list = object_input_list)
 				elif link_mode == 'direct':
-					for obj_input in (self.get_implicit_input(self.implicit_object_input) + add_rule_vars(opts = compiler_opts)):
+					for obj_input in (self.get_implicit_input(self.implicit_object_input) + add_rule_vars(self.registry, opts = compiler_opts)):
 						yield obj_input
 					link_mode = 'direct_obj' # object input is only added once in direct link_mode
 				if link_mode == 'direct_obj':
@@ -613,7 +906,7 @@ class Context(object):
 		target = self.create_target(build_name, rule = rule, input_list = list(link_input),
 			add_self_to_on_use_inputs = add_self_to_on_use_inputs,
 			target_type = target_type, **kwargs)
-		Context.targets.append(target)
+		self.registry.targets.append(target)
 		return target
 
 	def object_file(self, obj_name, input_list = None, compiler_opts = None, **kwargs):
@@ -626,10 +919,10 @@ class Context(object):
 		if len(source_target_type) != 1:
 			raise Exception('Unable to find unique handler (%s) to generate %s' % (repr(source_target_type), obj_name))
 		install_name = get_normed_name(obj_name, self.platform.extensions['object'])
-		build_name = os.path.join(self.get_basepath(self.basepath_object_file), install_name)
+		build_name = os.path.join(self.get_basepath(self.basepath_object_file, shared = True), install_name)
 		return self.create_target(build_name, install_name = install_name, user_name = obj_name,
 			target_type = 'object', rule = self.find_rule(source_target_type.pop(), 'object'),
-			input_list = self.get_implicit_input(self.implicit_object_input) + input_list + add_rule_vars(opts = compiler_opts),
+			input_list = self.get_implicit_input(self.implicit_object_input) + input_list + add_rule_vars(self.registry, opts = compiler_opts),
 			add_self_to_on_use_inputs = True, **kwargs)
 
 	def shared_library(self, lib_name, input_list = None, **kwargs):
@@ -639,12 +932,16 @@ class Context(object):
 		if link_name.startswith('lib'):
 			link_name = link_name[3:]
 		if (input_list is None) and not kwargs:
-			if not os.path.exists(install_name):
+			if not os.path.exists(self.registry.get_path(install_name)):
 				raise Exception('Unable to create reference to shared library: %s does not exist!' % repr(install_name))
-			return RuleVariables(dict.fromkeys(['link_exe', 'link_shared'], {'opts':
-				['-L%s' % lib_path, '-Wl,-rpath %s' % os.path.abspath(lib_path), '-l%s' % link_name]}))
+			return self.registry.get_rule_variables(dict.fromkeys(['link_exe', 'link_shared'], {'opts':
+				['-L%s' % lib_path, '-Wl,-rpath %s' % self.registry.get_path(lib_path), '-l%s' % link_name]}))
 		if not input_list:
 			raise Exception('shared_library(%s) was defined with empty input list!' % repr(lib_name))
+		(load_profile_compile_opts, load_profile_link_opts) = get_load_profile_opts(kwargs.pop('load_profile', None))
+		if load_profile_compile_opts:
+			kwargs['compiler_opts'] = join_opts(kwargs.get('compiler_opts'), load_profile_compile_opts)
+			kwargs['linker_opts'] = join_opts(kwargs.get('linker_opts'), load_profile_link_opts)
 		on_use_variables = kwargs.pop('on_use_variables', {})
 		on_use_variables.setdefault(None, {}).setdefault('opts', [])
 		on_use_variables[None]['opts'] += ['-L%s' % lib_path, '-Wl,-rpath %s' % lib_path, '-l%s' % link_name]
@@ -659,9 +956,9 @@ class Context(object):
 	def static_library(self, lib_name, input_list = None, **kwargs):
 		install_name = get_normed_name(lib_name, self.platform.extensions['static'])
 		if (input_list is None) and not kwargs:
-			if not os.path.exists(install_name):
+			if not os.path.exists(self.registry.get_path(install_name)):
 				raise Exception('Unable to create reference to static library: %s does not exist!' % repr(install_name))
-			return InputFile(install_name, rule_list = ['link_exe', 'link_shared', 'link_static'])
+			return self.registry.get_input_file(install_name, rule_list = ['link_exe', 'link_shared', 'link_static'])
 		if not input_list:
 			raise Exception('static_library(%s) was defined with empty input list!' % repr(lib_name))
 		build_name = os.path.join(self.get_basepath(self.basepath_static_library), install_name)
@@ -678,8 +975,9 @@ class Context(object):
 			target_type = 'exe', input_list = input_list, add_self_to_on_use_inputs = False,
 			implicit_input_list = self.get_implicit_input(self.implicit_executable_input), **kwargs)
 
-	def install(self, target_list, destination = None):
+	def install(self, target_list, destination = None, mode = None, batch = False):
 		result = []
+		batch_by_key = {}
 		for obj in ensure_list(target_list):
 			obj_target_type = self.find_target_type(obj)
 			install_name = obj.name
@@ -687,27 +985,129 @@ class Context(object):
 				install_name = obj.install_name
 			prefix = self.platform.install_paths[obj_target_type]
 			if destination:
-				prefix = os.path.abspath(os.path.expanduser(os.path.expandvars(destination)))
+				prefix = self.registry.get_path(os.path.expanduser(os.path.expandvars(destination)))
 			install_name = os.path.join(prefix, install_name)
 			rule = self.find_rule(obj_target_type, 'install')
+			install_mode = mode or self.install_mode or default_install_mode
+			install_cmd = get_install_cmd(install_mode, obj_target_type)
+			if (rule.name in ['install', 'install_lib']) and ((install_mode != default_install_mode) or batch):
+				# rules of the platform (and not eg. the thin archive install) - the default rules are kept unchanged
+				install_params = {}
+				if install_mode in install_restat_modes:
+					install_params['restat'] = 1
+				rule = Rule(rule.connection, rule.name, '$INSTALL $in $out', rule.desc, {'INSTALL': install_cmd},
+					**install_params)
+				if batch and (os.path.dirname(install_name) == prefix):
+					batch_key = (rule.defaults['INSTALL'], prefix)
+					batch_by_key.setdefault(batch_key, (rule, prefix, []))[2].append((obj, install_name))
+					continue
 			target = self.create_target(install_name, rule = rule, input_list = [TargetAlias(obj)])
 			result.append(target)
-			Context.install_targets.append(target)
+			self.registry.install_targets.append(target)
+		for batch_key in sorted(batch_by_key): # install all files going to the same directory with one command
+			(rule, prefix, entries) = batch_by_key[batch_key]
+			batch_rule = Rule(rule.connection, 'install_batch', '$INSTALL -t ${destination} $in && touch $out',
+				'installing files to ${destination}', rule.defaults)
+			stamp_name = 'install_%s.stamp' % calc_hash([prefix] + sorted(map(lambda entry: entry[0].name, entries)))
+			entries = list(map(lambda entry: (TargetAlias(entry[0]), entry[1], rule), entries))
+			target = self.create_target(os.path.join(self.get_basepath(None), stamp_name), rule = batch_rule,
+				input_list = list(map(lambda entry: entry[0], entries)) + add_rule_vars(self.registry, destination = prefix),
+				implicit_outputs = list(map(lambda entry: entry[1], entries)))
+			self.registry.install_batches.append((target, entries))
+			result.append(target)
+			self.registry.install_targets.append(target)
 		return result
 
+	def test(self, target, args = None, env = None, data = None, timeout = None, shards = None, name = None):
+		# the test is only run again if the executable or its data was changed
+		if self.find_target_type(target) != 'exe':
+			raise Exception('Tests require an executable - got %r' % target)
+		# strings are passed unchanged to the shell - the items of lists and dicts are quoted
+		if isinstance(env, dict):
+			env = list(map(lambda key: '%s=%s' % (key, env[key]), sorted(env)))
+		if isinstance(env, (list, tuple)):
+			env = list(map(shell_quote, env))
+		if isinstance(args, (list, tuple)):
+			args = str.join(' ', map(shell_quote, args))
+		test_exe = './$in' # executables in the build directory are not found in the PATH
+		if os.path.isabs(target.name):
+			test_exe = '$in'
+		# all tests share a single pool (its depth is derived from the last build report - see Pool)
+		rule = Rule(('exe', 'test'), 'run_test', test_run_cmd % test_exe, 'test $out', {}, pool = Pool('test', 'auto'))
+		test_name = os.path.join(self.get_basepath(None), 'test', name or target.user_name or os.path.basename(target.name))
+		data_deps = [BuildSource(on_use_deps = {None: self.force_build_source(data)})]
+		result = []
+		for shard in range(shards or 1):
+			test_env = list(ensure_list(env or []))
+			stamp_name = test_name + '.stamp'
+			if shards:
+				test_env.extend(map(lambda prefix: '%sTOTAL_SHARDS=%d %sSHARD_INDEX=%d' % (prefix, shards, prefix, shard),
+					test_shard_env_prefixes))
+				stamp_name = '%s.shard%d.stamp' % (test_name, shard)
+			target_test = self.create_target(stamp_name, rule = rule.clone(), input_list = [TargetAlias(target)] + data_deps +
+				add_rule_vars(self.registry, args = args, env = str.join(' ', test_env), timeout = str(timeout or 0)))
+			result.append(target_test)
+			self.registry.test_targets.append(target_test)
+		return result
+
+	def pgo(self, target, training, bolt = False):
+		# the instrumented target is trained to optimize a second variant of the target with the profile
+		linker = self.tools['linker']
+		if linker.pgo_family not in pgo_families:
+			raise Exception('Profile guided optimization is not supported by %r' % linker)
+		if self.find_target_type(target) != 'exe':
+			raise Exception('Profile guided optimization requires an executable - got %r' % target)
+		(gen_compile_opts, gen_link_opts, use_compile_opts, train_cmd) = pgo_families[linker.pgo_family]
+		if bolt and not probe_bolt():
+			sys.stderr.write('Unable to find llvm-bolt - skipping post-link optimization of %s\n' % target.name)
+			bolt = False
+		pgo_dn = os.path.join(self.get_basepath(None), 'pgo')
+		(instrumented_dn, optimized_dn) = (os.path.join(pgo_dn, 'instrumented'), os.path.join(pgo_dn, 'optimized'))
+		pgo_vars = {'profile': os.path.join(pgo_dn, 'profile', target.name),
+			'training': str.join(' && ', ensure_list(training))}
+		instrumented = clone_target_variant(self.registry, target, instrumented_dn,
+			Configuration('pgo_instrumented', gen_compile_opts % dict(pgo_vars,
+				variant = '$$PWD/' + instrumented_dn), gen_link_opts).get_implicit_input(self.registry))
+		profile = self.create_target(os.path.join(pgo_dn, target.name + '.profile'),
+			rule = Rule(('exe', 'pgo'), 'pgo_train', train_cmd % pgo_vars, 'training $in', {}),
+			input_list = [TargetAlias(instrumented)])
+		optimized_input = Configuration('pgo_optimized', use_compile_opts % dict(pgo_vars,
+			variant = '$$PWD/' + optimized_dn), bolt and '-Wl,--emit-relocs').get_implicit_input(self.registry)
+		optimized = clone_target_variant(self.registry, target, optimized_dn,
+			optimized_input + [BuildSource(on_use_deps = {'compile_': [profile]})])
+		if bolt:
+			optimized = self._bolt(target.name, optimized, pgo_dn, pgo_vars)
+		self.registry.pgo_targets.append(optimized)
+		return optimized
+
+	def _bolt(self, name, target, pgo_dn, pgo_vars):
+		# the binary optimized by the compiler is instrumented and trained again to reorder its code layout
+		bolt_vars = dict(pgo_vars, profile = pgo_vars['profile'] + '.bolt')
+		instrumented = self.create_target(os.path.join(pgo_dn, 'bolt_instrumented', name),
+			rule = Rule(('exe', 'bolt'), 'bolt_instrument', bolt_instrument_cmd % bolt_vars, 'instrumenting $out', {}),
+			input_list = [TargetAlias(target)])
+		profile = self.create_target(os.path.join(pgo_dn, name + '.fdata'),
+			rule = Rule(('exe', 'bolt'), 'bolt_train', bolt_train_cmd % bolt_vars, 'training $in', {}),
+			input_list = [TargetAlias(instrumented)])
+		return self.create_target(os.path.join(pgo_dn, 'bolt', name),
+			rule = Rule(('exe', 'bolt'), 'bolt_optimize', bolt_optimize_cmd, 'optimizing $out', {}),
+			input_list = [TargetAlias(target), BuildSource(on_use_deps = {None: [profile]},
+				on_use_variables = {None: {'profile': [profile.name]}})],
+			target_type = 'exe', install_name = target.install_name, user_name = target.user_name)
+
 	def _push_tracker(self):
-		self._tracker.append((len(Context.targets), len(Context.install_targets)))
+		self._tracker.append((len(self.registry.targets), len(self.registry.install_targets)))
 
 	def _pop_tracker(self):
 		(idx_targets, idx_install_targets) = self._tracker.pop()
-		return (Context.targets[idx_targets:], Context.install_targets[idx_install_targets:])
+		return (self.registry.targets[idx_targets:], self.registry.install_targets[idx_install_targets:])
 
 	def include(self, build_file_list, inherit = False, target_name = None, prefix_mode = None):
 		result = []
 		self._push_tracker()
 		for build_cfg in ensure_list(build_file_list):
 			build_name = None
-			if os.path.isdir(build_cfg):
+			if os.path.isdir(self.registry.get_path(build_cfg)):
 				build_name = build_cfg.replace('/', '_').replace('\\', '_').replace('.', '_')
 				build_cfg = os.path.join(build_cfg, 'build.py')
 			build_path = os.path.dirname(build_cfg)
@@ -723,6 +1123,7 @@ class Context(object):
 				kwargs['basepath_static_library'] = self.basepath_static_library
 				kwargs['basepath_shared_library'] = self.basepath_shared_library
 				kwargs['basepath_executable'] = self.basepath_executable
+				kwargs['install_mode'] = self.install_mode
 			self._push_tracker()
 			ctx = Context(self.registry, self.platform, self.tools,
 				os.path.join(self.prefix, build_path), prefix_mode = prefix_mode, **kwargs)
@@ -807,11 +1208,15 @@ class ToolHolder(object):
 		return list(map(lambda name_tool: name_tool[1], sorted(self._tools.items())))
 
 
-def create_macro(expr):
+def create_macro(registry, expr):
 	rule_list = []
 	for lang in ['c', 'cpp']:
 		rule_list.extend(['compile_' + lang, 'compile_link_exe_' + lang, 'compile_link_shared_' + lang])
-	return RuleVariables(dict.fromkeys(rule_list, {'opts': ['-D' + expr]}))
+	return registry.get_rule_variables(dict.fromkeys(rule_list, {'opts': ['-D' + expr]}))
+
+
+class BuildFileError(Exception):
+	pass
 
 
 def format_exception(bfn, ex):
@@ -821,7 +1226,7 @@ def format_exception(bfn, ex):
 		exinfo = exinfo[1:]
 		lineno = ex.lineno
 		content = ''
-		sys.stderr.write('Error while processing %s:%s\n\t%s\n' % (os.path.abspath(bfn), lineno, content.strip()))
+		sys.stderr.write('Error while processing %s:%s\n\t%s\n' % (bfn, lineno, content.strip()))
 	else:
 		exec_line = None
 		exloc = traceback.extract_tb(sys.exc_info()[2])
@@ -830,10 +1235,10 @@ def format_exception(bfn, ex):
 				exec_line = idx
 		if exec_line is not None:
 			exloc = [(bfn, exloc[exec_line][1], '', linecache.getline(bfn, exloc[exec_line][1]))] + exloc[exec_line:]
-		sys.stderr.write('Error while processing %s\n' % os.path.abspath(bfn))
+		sys.stderr.write('Error while processing %s\n' % bfn)
 		sys.stderr.write(str.join('', traceback.format_list(exloc)))
 	sys.stderr.write(str.join('', exinfo))
-	sys.exit(1)
+	raise BuildFileError('Error while processing %s' % bfn)
 
 
 def run_build_file(bfn, ctx, user_env):
@@ -845,7 +1250,8 @@ def run_build_file(bfn, ctx, user_env):
 		'pyrate_version': pyrate_version,
 		'tools': ctx.tools,
 		'toolchain': ctx.tools.toolchain,
-		'macro': create_macro,
+		'configuration': getattr(ctx.registry.configuration, 'name', None),
+		'macro': lambda expr: create_macro(ctx.registry, expr),
 		'version': ver,
 		# stable API
 		'create_external': default_ctx_call(exec_globals, Context.create_external),
@@ -858,8 +1264,10 @@ def run_build_file(bfn, ctx, user_env):
 		'match': default_ctx_call(exec_globals, Context.match),
 		'match_libs': default_ctx_call(exec_globals, Context.match_libs),
 		'object_file': default_ctx_call(exec_globals, Context.object_file),
+		'pgo': default_ctx_call(exec_globals, Context.pgo),
 		'shared_library': default_ctx_call(exec_globals, Context.shared_library),
 		'static_library': default_ctx_call(exec_globals, Context.static_library),
+		'test': default_ctx_call(exec_globals, Context.test),
 		'use_external': default_ctx_call(exec_globals, Context.use_external),
 		'use_toolchain': default_ctx_call(exec_globals, Context.use_toolchain),
 		# development API
@@ -873,6 +1281,9 @@ def run_build_file(bfn, ctx, user_env):
 		'Rule': Rule,
 	})
 	exec_globals.update(user_env)
+	bfn = ctx.registry.get_path(bfn)
+	if get_generation_cache() is not None:
+		get_generation_cache().build_files.add(bfn)
 	with open(bfn) as bfp:
 		try:
 			exec(bfp.read(), exec_globals)
@@ -881,40 +1292,135 @@ def run_build_file(bfn, ctx, user_env):
 	return exec_globals
 
 
-def generate_build_file(bfn, ofn, mode):
-	if os.path.dirname(bfn):
-		os.chdir(os.path.dirname(bfn))
-		bfn = os.path.basename(bfn)
-
-	registry = Registry()
-	platform = Platform_linux()
-	tools = ToolHolder([], {})
-	ctx = Context(registry, platform, tools, '', None)
-	ctx.tools.toolchain.append(Toolchain_GCC(ctx))
-	user_env = {}
-	if mode:
-		user_env['build_output'] = ['makefile']
-	exec_globals = run_build_file(bfn, ctx, user_env)
-
-	default_targets = exec_globals.get('default_targets')
-	(rules, targets) = registry.write()
-	if Context.install_targets:
-		targets.append(BuildTarget('install', phony_rule, list(map(lambda t: InputFile(t.name), Context.install_targets))))
-	target_all = BuildTarget('all', phony_rule, list(map(lambda t: InputFile(t.name), Context.targets)))
-	targets.append(target_all)
-	default_targets = ensure_list(default_targets)
-	if default_targets is None:
-		default_targets = [target_all]
-
-	bsys_list = exec_globals.get('build_output', ['ninja'])
-	for bsys in bsys_list:
-		if ofn and (len(bsys_list) > 1):
-			ofn = os.path.splitext(ofn)[0] + '.' + bsys
-		process_build_output(bsys, targets, rules, default_targets, ofn)
+class Session(object):
+	# state of a single build file generation - sessions don't depend on the working directory
+	# and are independent of each other (several sessions can run concurrently in separate threads)
+	def __init__(self, bfn, user_env = None, configurations = None, cache = None, hash_mode = 'structural'):
+		bfn = os.path.abspath(bfn)
+		self.hash_mode = get_hash_mode(hash_mode)
+		(self.bfn, self.platform) = (os.path.basename(bfn), Platform_linux())
+		self.registry = Registry(os.path.dirname(bfn))
+		(self.user_env, self.configurations, self.cache) = (user_env or {}, configurations, cache)
+		if self.cache is None: # probe results are shared between the configurations
+			self.cache = GenerationCache()
+		(self.exec_globals, self.targets_by_config, self.context) = ({}, [], None)
+
+	def _run_default_context(self):
+		tools = ToolHolder([], {})
+		self.context = Context(self.registry, self.platform, tools, '', None)
+		self.context.tools.toolchain.append(Toolchain_GCC(self.context))
+		return run_build_file(self.bfn, self.context, self.user_env)
+
+	def _run_configurations(self):
+		# evaluate the build file for each configuration
+		registry = self.registry
+		try:
+			for config in get_configurations(self.configurations):
+				registry.configuration = config
+				(idx_targets, idx_install_targets) = (len(registry.targets), len(registry.install_targets))
+				self.exec_globals = self._run_default_context()
+				if self.targets_by_config: # install targets are only taken from the first configuration
+					install_targets = registry.install_targets[idx_install_targets:]
+					del registry.install_targets[idx_install_targets:]
+					registry.target_list = list(filter(lambda t: t not in install_targets, registry.target_list))
+				self.targets_by_config.append((config.name, registry.targets[idx_targets:]))
+		finally:
+			registry.configuration = None
+
+	def get_path(self, fn):
+		return self.registry.get_path(fn)
+
+	def generate(self, output = None, rusage = False, report = False, report_trace = None, shards = None,
+			redundant_sources = False, factor_sources = False, affected = None,
+			artifact_cache = None, artifact_cache_size = '10G'):
+		# returns the content of the build files by build system - files are only written if output is set
+		(cache_orig, hash_mode_orig) = (get_generation_cache(), getattr(generation_state, 'hash_mode', 'structural'))
+		(generation_state.cache, generation_state.hash_mode) = (self.cache, self.hash_mode)
+		try:
+			return self._generate(output, rusage, report, report_trace, shards, redundant_sources, factor_sources,
+				affected, artifact_cache, artifact_cache_size)
+		finally:
+			(generation_state.cache, generation_state.hash_mode) = (cache_orig, hash_mode_orig)
+
+	def _generate(self, output, rusage, report, report_trace, shards, redundant_sources, factor_sources, affected,
+			artifact_cache, artifact_cache_size):
+		registry = self.registry
+		if self.configurations:
+			self._run_configurations()
+		else:
+			self.exec_globals = self._run_default_context()
+		if factor_sources:
+			factor_redundant_sources(self.context, registry.target_list)
+		if redundant_sources:
+			return write_redundancy_report(registry.target_list)
+
+		default_targets = self.exec_globals.get('default_targets')
+		(rules, targets) = registry.write()
+		add_module_dependencies(rules, targets)
+		if registry.test_targets:
+			targets.append(BuildTarget('check', phony_rule, list(map(lambda t: InputFile(t.name), registry.test_targets))))
+		if registry.pgo_targets:
+			targets.append(BuildTarget('pgo', phony_rule, list(map(lambda t: InputFile(t.name), registry.pgo_targets))))
+		if registry.install_targets:
+			targets.append(BuildTarget('install', phony_rule, list(map(lambda t: InputFile(t.name), registry.install_targets))))
+		for (config_name, config_targets) in self.targets_by_config:
+			targets.append(BuildTarget(config_name, phony_rule, list(map(lambda t: InputFile(t.name), config_targets))))
+		target_all = BuildTarget('all', phony_rule, list(map(lambda t: InputFile(t.name), registry.targets)))
+		targets.append(target_all)
+		default_targets = ensure_list(default_targets)
+		if default_targets is None:
+			default_targets = [target_all]
+		ofn = None
+		if output not in [None, True]:
+			ofn = self.get_path(output)
+		if affected is not None: # list of changed files (relative to the directory of the build file)
+			ninja_fn = ofn or self.get_path('build.ninja')
+			affected_targets = find_affected_targets(targets, list(map(self.get_path, affected)),
+				registry.basedir, os.path.dirname(ninja_fn), ninja_fn)
+			targets.append(BuildTarget('affected', phony_rule, list(map(lambda t: InputFile(t.name), affected_targets))))
+		if report:
+			return write_build_report(targets, os.path.dirname(ofn or self.get_path('build.ninja')), report_trace)
+		if artifact_cache: # relative to the directory of the build file
+			if not os.path.isabs(artifact_cache):
+				artifact_cache = os.path.relpath(self.get_path(artifact_cache),
+					os.path.dirname(ofn or self.get_path('build.ninja')))
+			enable_artifact_cache(rules, targets, artifact_cache, artifact_cache_size)
+		if rusage:
+			for rule in rules:
+				if rule.cmd:
+					rule.cmd = get_rusage_cmd(rule)
+
+		result = {}
+		bsys_list = self.exec_globals.get('build_output', ['ninja'])
+		for bsys in bsys_list:
+			if ofn and (len(bsys_list) > 1):
+				ofn = os.path.splitext(ofn)[0] + '.' + bsys
+			result[bsys] = process_build_output(bsys, targets, rules, default_targets, ofn,
+				basedir = registry.basedir, write = output is not None)
+		if shards and (output is not None):
+			write_shards(targets, rules, default_targets, ofn or self.get_path('build.ninja'), shards)
+		if affected is not None:
+			result['affected'] = list(map(lambda t: t.name, affected_targets))
+		return result
+
+
+def generate(build_file, output = None, backends = None, configurations = None, user_env = None, cache = None,
+		hash_mode = 'structural', **kwargs):
+	# output: name of the build file (relative to the directory of build_file) or True for the default name
+	user_env = dict(user_env or {})
+	if backends:
+		user_env['build_output'] = ensure_list(backends)
+	return Session(build_file, user_env, configurations, cache, hash_mode).generate(output, **kwargs)
+
+
+def generate_build_file(bfn, ofn, mode, **kwargs):
+	return generate(bfn, output = ofn or True, backends = mode, **kwargs)
 
 
 def main():
 	version_info = 'pyrate version ' + __version__
+	if sys.argv[1:2] == ['-t']: # run helper tool
+		return run_tool(sys.argv[2:])
 	try:
 		if os.environ.get('TESTOLDIMPORTS'):
 			raise ImportError()
@@ -923,18 +1429,76 @@ def main():
 		parser.add_argument('build_file', nargs = '?', default = 'build.py',
 			help = 'name of the input file - default: build.py')
 		parser.add_argument('-V', '--version', action = 'version', version = version_info)
-		parser.add_argument('-M', '--makefile', action = 'store_true', help = 'enable makefile mode')
+		parser.add_argument('-M', '--makefile', action = 'store_const', const = 'makefile',
+			dest = 'mode', help = 'enable makefile mode')
+		parser.add_argument('--makefile-compact', action = 'store_const', const = 'makefile-compact',
+			dest = 'mode', help = 'enable compact makefile mode (pattern rules)')
+		parser.add_argument('--hash-compat', action = 'store_true', default = False,
+			help = 'use the hash function of pyrate 0.2.11 (keeps the names of renamed targets)')
+		parser.add_argument('--rusage', action = 'store_true', default = False,
+			help = 'record cpu time and peak memory usage of each build command')
+		parser.add_argument('--report', action = 'store_true', default = False,
+			help = 'report the critical path of the last build (from .ninja_log and the rusage log)')
+		parser.add_argument('--report-trace', nargs = 1, default = None,
+			help = 'write the last build as chrome trace (used together with --report)')
+		parser.add_argument('--shards', type = int, default = None,
+			help = 'split the build into the given number of ninja files and a final merge stage')
+		parser.add_argument('--redundant-sources', action = 'store_true', default = False,
+			help = 'report sources that are compiled several times (with the flags that differ)')
+		parser.add_argument('--factor-sources', action = 'store_true', default = False,
+			help = 'move sources compiled several times with identical flags into shared static libraries')
+		parser.add_argument('--affected', action = 'append', default = None,
+			help = 'print the targets affected by the given (comma separated) changed files ' +
+				'and add them to the phony target "affected"')
+		parser.add_argument('--artifact-cache', default = None, dest = 'artifact_cache',
+			help = 'restore the outputs of compile and link commands from the given cache directory')
+		parser.add_argument('--artifact-cache-size', default = '10G', dest = 'artifact_cache_size',
+			help = 'maximal size of the artifact cache - default: 10G')
+		parser.add_argument('--watch', action = 'store_true', default = False,
+			help = 'keep running and regenerate the build file when the build configuration changes')
+		parser.add_argument('--configurations', default = None,
+			help = 'generate the given (comma separated) configurations: %s' % str.join(', ', sorted(build_configurations)))
 		parser.add_argument('-o', '--output', nargs = 1, default = None,
 			help = 'name of output build file')
 		args = parser.parse_args()
 		if args.output:
 			args.output = args.output[0]
+		if args.report_trace:
+			args.report_trace = args.report_trace[0]
 		bfn = args.build_file
 	except ImportError:
 		optparse = __import__('optparse')
 		parser = optparse.OptionParser(usage = 'pyrate [options] build_file')
 		parser.add_option('-V', '--version', action='store_true', help = 'display version')
-		parser.add_option('-M', '--makefile', action = 'store_true', help = 'enable makefile mode')
+		parser.add_option('-M', '--makefile', action = 'store_const', const = 'makefile',
+			dest = 'mode', help = 'enable makefile mode')
+		parser.add_option('--makefile-compact', action = 'store_const', const = 'makefile-compact',
+			dest = 'mode', help = 'enable compact makefile mode (pattern rules)')
+		parser.add_option('--hash-compat', action = 'store_true', default = False,
+			help = 'use the hash function of pyrate 0.2.11 (keeps the names of renamed targets)')
+		parser.add_option('--rusage', action = 'store_true', default = False,
+			help = 'record cpu time and peak memory usage of each build command')
+		parser.add_option('--report', action = 'store_true', default = False,
+			help = 'report the critical path of the last build (from .ninja_log and the rusage log)')
+		parser.add_option('--report-trace', default = None, dest = 'report_trace',
+			help = 'write the last build as chrome trace (used together with --report)')
+		parser.add_option('--shards', type = 'int', default = None,
+			help = 'split the build into the given number of ninja files and a final merge stage')
+		parser.add_option('--redundant-sources', action = 'store_true', default = False,
+			help = 'report sources that are compiled several times (with the flags that differ)')
+		parser.add_option('--factor-sources', action = 'store_true', default = False,
+			help = 'move sources compiled several times with identical flags into shared static libraries')
+		parser.add_option('--affected', action = 'append', default = None,
+			help = 'print the targets affected by the given (comma separated) changed files ' +
+				'and add them to the phony target "affected"')
+		parser.add_option('--artifact-cache', default = None, dest = 'artifact_cache',
+			help = 'restore the outputs of compile and link commands from the given cache directory')
+		parser.add_option('--artifact-cache-size', default = '10G', dest = 'artifact_cache_size',
+			help = 'maximal size of the artifact cache - default: 10G')
+		parser.add_option('--watch', action = 'store_true', default = False,
+			help = 'keep running and regenerate the build file when the build configuration changes')
+		parser.add_option('--configurations', default = None,
+			help = 'generate the given (comma separated) configurations: %s' % str.join(', ', sorted(build_configurations)))
 		parser.add_option('-o', '--output', default = None,
 			help = 'name of output build file', dest='output')
 		(args, posargs) = parser.parse_args()
@@ -948,12 +1512,192 @@ def main():
 			sys.stderr.write(version_info + '\n')
 			sys.exit(os.EX_OK)
 
-	generate_build_file(bfn, args.output, args.makefile)
+	if args.report_trace:
+		args.report_trace = os.path.abspath(args.report_trace)
+	if args.affected:
+		args.affected = list(map(os.path.abspath, filter(None, str.join(',', args.affected).split(','))))
+	if args.artifact_cache and not os.path.isabs(args.artifact_cache): # relative to the directory of the build file
+		args.artifact_cache = os.path.relpath(os.path.abspath(args.artifact_cache), os.path.dirname(os.path.abspath(bfn)))
+	kwargs = dict(rusage = args.rusage, report = args.report, report_trace = args.report_trace, shards = args.shards,
+		configurations = args.configurations, redundant_sources = args.redundant_sources, factor_sources = args.factor_sources,
+		affected = args.affected, hash_mode = args.hash_compat and 'compat' or 'structural',
+		artifact_cache = args.artifact_cache, artifact_cache_size = args.artifact_cache_size)
+	if args.watch:
+		try:
+			return watch_build_file(bfn, args.output, args.mode, **kwargs)
+		except KeyboardInterrupt:
+			return os.EX_OK
+	try:
+		result = generate_build_file(bfn, args.output, args.mode, **kwargs)
+		if args.affected is not None:
+			for name in result['affected']:
+				sys.stdout.write(name + '\n')
+	except BuildFileError: # the error was already reported
+		return 1
 
 ################################################################################
 # Externals + helper functions
 ################################################################################
 
+def join_opts(*opts_list):
+	return str.join(' ', filter(None, opts_list))
+
+
+def get_lto_mode(lto):
+	if lto in [None, False, 'off']:
+		return None
+	elif lto is True:
+		return 'full'
+	elif lto in ['full', 'thin']:
+		return lto
+	raise Exception('Unknown LTO mode %s - available modes: off, full, thin' % repr(lto))
+
+
+debug_info_compile_opts = {
+	'full': '-g',
+	'split': '-g',
+	'compressed': '-g -gz',
+	'gdb_index': '-g -ggnu-pubnames',
+}
+# only used by the compile rules of object files - the names of the .dwo files of
+# compile+link steps depend on the compiler version, so they can't be declared as outputs
+debug_info_object_opts = {
+	'split': '-gsplit-dwarf', # debug info stays in .dwo files and is not processed by the linker
+}
+debug_info_link_opts = {
+	'compressed': '-Wl,--compress-debug-sections=zlib',
+	'gdb_index': '-Wl,--gdb-index',
+}
+debug_info_linkers = { # linkers supporting the debug info mode - selected if no linker is given
+	'gdb_index': ['mold', 'lld', 'gold'],
+}
+
+
+def get_debug_info_mode(debug_info):
+	if debug_info in [None, False, 'off']:
+		return None
+	elif debug_info is True:
+		return 'full'
+	elif debug_info in debug_info_compile_opts:
+		return debug_info
+	raise Exception('Unknown debug info mode %s - available modes: off, %s' % (repr(debug_info),
+		str.join(', ', sorted(debug_info_compile_opts))))
+
+
+# static archive mode: (command prefix, additional archiver flags)
+static_archive_modes = {
+	'full': ('rm -f $out && ', ''),
+	'thin': ('rm -f $out && ', 'T'), # the archive only references the object files
+	# members are updated based on their timestamps - the archive is recreated if it contains unknown members
+	'incremental': ('for m in $$($LINKER_STATIC t $out 2> /dev/null); do case " $in " in *" $$m "*|*"/$$m "*) ;; ' +
+		'*) rm -f $out; break;; esac; done; ', 'uU'),
+}
+
+
+def get_static_archive_mode(static_archive_mode):
+	if static_archive_mode in [None, False]:
+		return 'full'
+	elif static_archive_mode in static_archive_modes:
+		return static_archive_mode
+	raise Exception('Unknown static archive mode %s - available modes: %s' % (repr(static_archive_mode),
+		str.join(', ', sorted(static_archive_modes))))
+
+
+# load profile: (compiler options, linker options) - reduces the number of exported symbols, relocations
+# and symbol lookups that have to be processed by the dynamic loader
+load_profile_export_macro = 'PYRATE_EXPORT' # marks the exported symbols of the shared libraries
+load_profile_compile_opts = str.join(' ', [
+	'-fvisibility=hidden', "-D%s='__attribute__((visibility(\"default\")))'" % load_profile_export_macro,
+	'-fno-semantic-interposition', '-ffunction-sections', '-fdata-sections'])
+load_profiles = {
+	'default': (load_profile_compile_opts, '-Wl,--as-needed -Wl,--gc-sections'),
+	'bind_now': (load_profile_compile_opts, '-Wl,--as-needed -Wl,--gc-sections -Wl,-O1,--hash-style=gnu -Wl,-z,now'),
+}
+
+
+def get_load_profile(load_profile):
+	if load_profile in [None, False, 'off']:
+		return None
+	elif load_profile is True:
+		return 'default'
+	elif load_profile in load_profiles:
+		return load_profile
+	raise Exception('Unknown load profile %s - available profiles: off, %s' % (repr(load_profile),
+		str.join(', ', sorted(load_profiles))))
+
+
+def get_load_profile_opts(load_profile):
+	return load_profiles.get(get_load_profile(load_profile), (None, None))
+
+
+# linker name: (executable, version parser, minimal version, thread option)
+# the version is read from the output of the linker - selected by the compiler driver if available
+linker_infos = {
+	'mold': ('mold', lambda output: output.split()[1], '1.0', '-Wl,--thread-count=%d'),
+	'lld': ('ld.lld', lambda output: output.split('LLD')[1].split()[0], '11.0', '-Wl,--threads=%d'),
+	'gold': ('ld.gold', lambda output: output.splitlines()[0].split()[-1], '1.11', '-Wl,--threads -Wl,--thread-count=%d'),
+	'bfd': ('ld.bfd', lambda output: output.splitlines()[0].split()[-1], None, None),
+}
+linker_fallback_order = ['mold', 'lld', 'gold']
+
+
+def probe_linker(name, driver = None):
+	# the compiler driver has to accept -fuse-ld=<name> (eg. mold requires gcc 12.1)
+	linkers = getattr(get_generation_cache(), 'linkers', {})
+	key = (name, driver)
+	if key not in linkers:
+		(linker_exec, version_parser, version_min, thread_opt) = linker_infos[name]
+		linkers[key] = None
+		cmd = [linker_exec, '--version']
+		if driver:
+			cmd = driver.split() + ['-fuse-ld=%s' % name, '-Wl,--version']
+		try:
+			version = Version(version_parser(run_process(cmd)[0]))
+			if (version_min is None) or (version >= version_min):
+				linkers[key] = version
+		except (ProcessError, VersionError, IndexError):
+			pass
+	return linkers[key]
+
+
+def get_linker_opts(linker, linker_threads = None, driver = None):
+	if not linker:
+		return (None, None)
+	if linker == 'auto':
+		linker = linker_fallback_order
+	linker_list = ensure_list(linker)
+	for name in linker_list:
+		if name not in linker_infos:
+			raise Exception('Unknown linker %s - available linkers: %s' % (repr(name), str.join(', ', sorted(linker_infos))))
+		if probe_linker(name, driver):
+			linker_opts = '-fuse-ld=%s' % name
+			thread_opt = linker_infos[name][3]
+			if thread_opt and linker_threads:
+				linker_opts += ' ' + (thread_opt % linker_threads)
+			elif name == 'gold': # gold is single threaded by default
+				linker_opts += ' -Wl,--threads'
+			return (name, linker_opts)
+	sys.stderr.write('Unable to find linker %s - using default linker\n' % str.join(' / ', linker_list))
+	return (None, None)
+
+
+# ThinLTO cache options (cache directory and pruning policy) by linker - None: LLVM gold plugin
+thinlto_cache_opts = {
+	'lld': '-Wl,--thinlto-cache-dir=%s -Wl,--thinlto-cache-policy=%s',
+	None: '-Wl,-plugin-opt,cache-dir=%s -Wl,-plugin-opt,cache-policy=%s',
+}
+
+
+def get_lto_opts(family, lto):
+	lto_opts = {
+		'gcc': {'full': '-flto', 'thin': '-flto'},
+		'llvm': {'full': '-flto', 'thin': '-flto=thin'},
+	}
+	lto = get_lto_mode(lto)
+	if lto:
+		return lto_opts[family][lto]
+
+
 class External(BuildSource):
 	def __init__(self, ctx, on_use_variables = None, rules = None, target_types_by_ext = None,
 			required_inputs_by_target_type = None):
@@ -983,79 +1727,273 @@ class External(BuildSource):
 External.available = {}
 
 
+class LazyExternal(External):
+	target_type = None
+
+	def __init__(self, ctx, name, args, kwargs, optional = False):
+		(self._lazy_ctx, self._lazy_args, self._lazy_kwargs) = (ctx, args, kwargs)
+		(self._lazy_optional, self._lazy_probed, self._lazy_result) = (optional, False, None)
+		self.name = name
+
+	def get_external(self):
+		if not self._lazy_probed:
+			self._lazy_probed = True
+			self._lazy_result = self._lazy_ctx.find_external(self.name, *self._lazy_args, **self._lazy_kwargs)
+		return self._lazy_result
+
+	def _get_used_external(self):
+		ext = self.get_external()
+		if (ext is None) and not self._lazy_optional:
+			raise Exception('Unable to use missing external %s' % self.name)
+		return ext
+
+	def _get_on_use(attr_name):
+		return property(lambda self: getattr(self._get_used_external() or BuildSource(), attr_name))
+	on_use_inputs = _get_on_use('on_use_inputs')
+	on_use_deps = _get_on_use('on_use_deps')
+	on_use_variables = _get_on_use('on_use_variables')
+	del _get_on_use
+
+	def get_hash(self):
+		ext = self._get_used_external()
+		if ext is None:
+			return BuildSource.get_hash(self)
+		return ext.get_hash()
+
+	def __getattr__(self, name):
+		if name.startswith('_lazy'):
+			raise AttributeError(name)
+		return getattr(self._get_used_external(), name)
+
+	def __bool__(self):
+		return self.get_external() is not None
+	__nonzero__ = __bool__
+
+	def __repr__(self):
+		if not self._lazy_probed:
+			return '%s(%s)' % (self.__class__.__name__, self.name)
+		return repr(self._lazy_result)
+
+	def __str__(self):
+		return repr(self)
+
+
 class External_linker(External):
+	pgo_family = None # selects the profile guided optimization flags
+
 	def __init__(self, ctx,
 			link_static, link_static_opts, link_static_def, link_static_opts_def,
 			link_shared, link_shared_opts, link_shared_def, link_shared_opts_def,
-			link_exe, link_exe_opts, link_exe_def, link_exe_opts_def):
+			link_exe, link_exe_opts, link_exe_def, link_exe_opts_def,
+			lto = None, lto_opts = None, lto_pool_depth = None, debug_info = None,
+			linker = None, linker_threads = None, static_archive_mode = None, load_profile = None):
+		self.lto = get_lto_mode(lto)
+		self.debug_info = get_debug_info_mode(debug_info)
+		self.static_archive_mode = get_static_archive_mode(static_archive_mode)
+		self.load_profile = get_load_profile(load_profile)
+		supported_linkers = debug_info_linkers.get(self.debug_info)
+		if supported_linkers and not linker:
+			linker = supported_linkers
+		(self.linker, linker_opts) = get_linker_opts(linker, linker_threads, link_exe or link_exe_def)
+		if supported_linkers and (self.linker not in supported_linkers):
+			raise Exception('Debug info mode %s requires one of the linkers %s' % (self.debug_info,
+				str.join(', ', supported_linkers)))
+		link_feature_opts = join_opts(linker_opts, self._get_lto_link_opts(lto_opts), debug_info_link_opts.get(self.debug_info),
+			get_load_profile_opts(self.load_profile)[1])
 		link_static = (link_static or link_static_def)
-		link_static_opts = (link_static_opts or link_static_opts_def)
+		(link_static_cmd, link_static_mode_opts) = static_archive_modes[self.static_archive_mode]
+		link_static_opts = (link_static_opts or link_static_opts_def) + link_static_mode_opts
 		link_shared = (link_shared or link_shared_def)
-		link_shared_opts = (link_shared_opts or link_shared_opts_def)
+		link_shared_opts = join_opts(link_shared_opts or link_shared_opts_def, link_feature_opts)
 		link_exe = (link_exe or link_exe_def)
-		link_exe_opts = (link_exe_opts or link_exe_opts_def)
+		link_exe_opts = join_opts(link_exe_opts or link_exe_opts_def, link_feature_opts)
+		link_params = {}
+		if self.lto: # each LTO link is already running in parallel
+			link_params['pool'] = Pool('link_lto', lto_pool_depth or 'auto')
+		rules = []
+		if self.static_archive_mode == 'thin': # installed archives have to contain the object files
+			rules.append(Rule(('static', 'install'), 'install_thin_archive',
+				'rm -f $out && $LINKER_STATIC rcs $out $$($LINKER_STATIC t $in)', 'installing static library $out',
+				{'LINKER_STATIC': link_static}))
 		External.__init__(self, ctx,
-			rules = [
+			rules = rules + [
 				Rule(('object', 'static'), 'link_static',
-					'rm -f $out && $LINKER_STATIC $LINKER_STATIC_FLAGS ${opts} $out $in', 'link(static) $out',
+					link_static_cmd + '$LINKER_STATIC $LINKER_STATIC_FLAGS ${opts} $out $in', 'link(static) $out',
 					{'LINKER_STATIC': link_static, 'LINKER_STATIC_FLAGS': link_static_opts}),
 				Rule(('object', 'shared'), 'link_shared',
-					'$LINKER_SHARED $LINKER_SHARED_FLAGS ${opts} -o $out $in', 'link(shared) $out',
-					{'LINKER_SHARED': link_shared, 'LINKER_SHARED_FLAGS': link_shared_opts}),
+					'$LINKER_SHARED $LINKER_SHARED_FLAGS -o $out $in ${opts}', 'link(shared) $out',
+					{'LINKER_SHARED': link_shared, 'LINKER_SHARED_FLAGS': link_shared_opts}, **link_params),
 				Rule(('object', 'exe'), 'link_exe',
-					'$LINKER_EXE $LINKER_EXE_FLAGS ${opts} -o $out $in', 'link(exe) $out',
-					{'LINKER_EXE': link_exe, 'LINKER_EXE_FLAGS': link_exe_opts})])
+					'$LINKER_EXE $LINKER_EXE_FLAGS -o $out $in ${opts}', 'link(exe) $out',
+					{'LINKER_EXE': link_exe, 'LINKER_EXE_FLAGS': link_exe_opts}, **link_params)])
+
+	def _get_lto_link_opts(self, lto_opts): # options may depend on the selected linker
+		return lto_opts
 
 
 class External_link_base(External_linker):
 	def __init__(self, ctx, link_static = None, link_static_opts = None,
 			link_shared = None, link_shared_opts = None,
-			link_exe = None, link_exe_opts = None):
+			link_exe = None, link_exe_opts = None, static_archive_mode = None):
 		External_linker.__init__(self, ctx,
 			link_static = link_static, link_static_opts = link_static_opts,
 			link_static_def = 'ar', link_static_opts_def = 'rcs',
 			link_shared = link_shared, link_shared_opts = link_shared_opts,
 			link_shared_def = 'ld', link_shared_opts_def = '-shared -fPIC',
 			link_exe = link_exe, link_exe_opts = link_exe_opts,
-			link_exe_def = 'ld', link_exe_opts_def = '')
+			link_exe_def = 'ld', link_exe_opts_def = '', static_archive_mode = static_archive_mode)
 External_link_base.register_external('link-base')
 
 
 class External_link_gcc(External_linker):
+	pgo_family = 'gcc'
+
 	def __init__(self, ctx, link_static = None, link_static_opts = None,
 			link_shared = None, link_shared_opts = None,
-			link_exe = None, link_exe_opts = None):
+			link_exe = None, link_exe_opts = None,
+			lto = None, lto_jobs = 'auto', lto_pool_depth = None, debug_info = None,
+			linker = None, linker_threads = None, static_archive_mode = None, load_profile = None):
+		lto_opts = None
+		if get_lto_mode(lto): # gcc has no separate thin mode - its LTO is always partitioned
+			lto_opts = '-flto=%s' % lto_jobs
 		External_linker.__init__(self, ctx,
 			link_static = link_static, link_static_opts = link_static_opts,
 			link_static_def = 'gcc-ar', link_static_opts_def = 'rcs',
 			link_shared = link_shared, link_shared_opts = link_shared_opts,
 			link_shared_def = 'gcc', link_shared_opts_def = '-shared -fPIC',
 			link_exe = link_exe, link_exe_opts = link_exe_opts,
-			link_exe_def = 'gcc', link_exe_opts_def = '')
+			link_exe_def = 'gcc', link_exe_opts_def = '',
+			lto = lto, lto_opts = lto_opts, lto_pool_depth = lto_pool_depth, debug_info = debug_info,
+			linker = linker, linker_threads = linker_threads, static_archive_mode = static_archive_mode,
+			load_profile = load_profile)
 External_link_gcc.register_external('link-gcc')
 
 
 class External_link_llvm(External_linker):
+	pgo_family = 'llvm'
+
 	def __init__(self, ctx, link_static = None, link_static_opts = None,
 			link_shared = None, link_shared_opts = None,
-			link_exe = None, link_exe_opts = None):
+			link_exe = None, link_exe_opts = None,
+			lto = None, lto_pool_depth = None, debug_info = None,
+			thinlto_cache_dir = '.thinlto_cache', thinlto_cache_policy = 'prune_after=168h:cache_size=10%',
+			linker = None, linker_threads = None, static_archive_mode = None, load_profile = None):
+		self._thinlto_cache = (thinlto_cache_dir, thinlto_cache_policy)
+		if (get_lto_mode(lto) == 'thin') and not linker: # the ThinLTO cache is best supported by lld
+			linker = 'lld'
 		External_linker.__init__(self, ctx,
 			link_static = link_static, link_static_opts = link_static_opts,
 			link_static_def = 'llvm-ar', link_static_opts_def = 'rcs',
 			link_shared = link_shared, link_shared_opts = link_shared_opts,
 			link_shared_def = 'clang', link_shared_opts_def = '-shared -fPIC',
 			link_exe = link_exe, link_exe_opts = link_exe_opts,
-			link_exe_def = 'clang', link_exe_opts_def = '')
+			link_exe_def = 'clang', link_exe_opts_def = '',
+			lto = lto, lto_opts = get_lto_opts('llvm', lto), lto_pool_depth = lto_pool_depth, debug_info = debug_info,
+			linker = linker, linker_threads = linker_threads, static_archive_mode = static_archive_mode,
+			load_profile = load_profile)
+
+	def _get_lto_link_opts(self, lto_opts):
+		if self.lto != 'thin':
+			return lto_opts
+		# lld has its own ThinLTO cache options - other linkers run the LLVM gold plugin
+		cache_opts = thinlto_cache_opts.get(self.linker, thinlto_cache_opts[None])
+		return join_opts(lto_opts, cache_opts % self._thinlto_cache)
 External_link_llvm.register_external('link-llvm')
 
 
+check_cache_file_name = '.pyrate_checks'
+check_sources = { # minimal program used to check compiler flags and headers
+	'c': 'int main(void) { return 0; }\n',
+	'cpp': 'int main() { return 0; }\n',
+	'fortran': 'program main\nend program main\n',
+}
+check_exts = {'c': '.c', 'cpp': '.cpp', 'fortran': '.f90'}
+
+
+def load_check_cache(fn):
+	import json
+	checks = getattr(get_generation_cache(), 'checks', {})
+	if fn not in checks:
+		checks[fn] = {}
+		if os.path.exists(fn):
+			try:
+				checks[fn] = json.load(open(fn))
+			except ValueError: # discard corrupted cache
+				pass
+	return checks[fn]
+
+
+def run_compiler_checks(cache_fn, compiler_id, cmd, ext, check_list, jobs = None):
+	# check_list = [(compiler options, source), ...] - uncached checks are compiled concurrently
+	import hashlib, json, multiprocessing, shutil, subprocess, tempfile
+	cache = load_check_cache(cache_fn)
+	def get_key(check):
+		return hashlib.md5(json.dumps([compiler_id, cmd, list(check)]).encode('utf-8')).hexdigest()
+	missing = sorted(set(filter(lambda check: get_key(check) not in cache, check_list)))
+	if missing:
+		(results, tmp_dn) = ({}, tempfile.mkdtemp(prefix = 'pyrate_check_'))
+		semaphore = threading.Semaphore(jobs or multiprocessing.cpu_count())
+		def run_check(idx, check):
+			(opts, source) = check
+			src_fn = os.path.join(tmp_dn, 'check%d%s' % (idx, ext))
+			src_fp = open(src_fn, 'w')
+			src_fp.write(source)
+			src_fp.close()
+			semaphore.acquire()
+			try:
+				try:
+					p = subprocess.Popen(cmd + opts.split() + ['-c', src_fn, '-o', src_fn + '.o'],
+						stdout = subprocess.PIPE, stderr = subprocess.STDOUT, cwd = tmp_dn)
+					p.communicate()
+					results[get_key(check)] = (p.returncode == 0)
+				except OSError:
+					results[get_key(check)] = False
+			finally:
+				semaphore.release()
+		threads = []
+		for (idx, check) in enumerate(missing):
+			threads.append(threading.Thread(target = run_check, args = (idx, check)))
+			threads[-1].start()
+		for thread in threads:
+			thread.join()
+		shutil.rmtree(tmp_dn, ignore_errors = True)
+		cache.update(results)
+		# the cache file is replaced atomically - results of concurrent writers are merged
+		try:
+			cache.update(dict(filter(lambda item: item[0] not in cache, json.load(open(cache_fn)).items())))
+		except (IOError, OSError, ValueError):
+			pass
+		(tmp_fd, tmp_fn) = tempfile.mkstemp(dir = os.path.dirname(cache_fn) or '.', prefix = check_cache_file_name + '.tmp')
+		try:
+			os.write(tmp_fd, json.dumps(cache, indent = 1, sort_keys = True).encode('utf-8'))
+			os.close(tmp_fd)
+			os.rename(tmp_fn, cache_fn)
+		except (IOError, OSError):
+			os.remove(tmp_fn)
+			raise
+	return list(map(lambda check: cache[get_key(check)], check_list))
+
+
 class External_SimpleCompiler(External): # C family compiler
 	std = property(lambda self: self._std, lambda self, value: self._set_std(value))
 
-	def __init__(self, ctx, lang, std, compiler, compiler_opts, var_prefix, ext_list, req_input = None):
+	def __init__(self, ctx, lang, std, compiler, compiler_opts, var_prefix, ext_list, req_input = None,
+			lto = None, lto_opts = None, debug_info = None, module_scan = None, load_profile = None):
 		self._std = None
-		self._var_prefix = var_prefix
-		self._compiler_opts = compiler_opts
+		(self._ctx, self._lang, self._compiler, self._var_prefix) = (ctx, lang, compiler, var_prefix)
+		self.debug_info = get_debug_info_mode(debug_info)
+		self.load_profile = get_load_profile(load_profile)
+		self._compiler_opts = join_opts(compiler_opts, lto_opts, debug_info_compile_opts.get(self.debug_info),
+			get_load_profile_opts(self.load_profile)[0])
+		self.lto = get_lto_mode(lto)
+		compile_params = {}
+		if self.debug_info == 'split':
+			compile_params['implicit_output_exts'] = ['.dwo']
+		if module_scan: # (scan command, module file name format, compiler options)
+			(scan_cmd, module_fn_format, module_opts) = module_scan
+			self._compiler_opts = join_opts(self._compiler_opts, module_opts)
+			compile_params['module_rules'] = get_module_rules(lang, var_prefix, scan_cmd, module_fn_format)
+			compile_params['restat'] = 1 # unchanged module files are not rewritten by the compiler
 		self._compiler_variables = {var_prefix: compiler, var_prefix + '_FLAGS': self._compiler_opts}
 		required_inputs_by_target_type = {
 			'linux': {'shared': [RuleVariables({'compile_' + lang: {'opts': ['-fPIC']}})]},
@@ -1066,15 +2004,16 @@ class External_SimpleCompiler(External): # C family compiler
 					required_inputs_by_target_type[platform].setdefault(target_type, []).extend(req_input[target_type])
 		External.__init__(self, ctx, rules = [
 				Rule((lang, 'object'), 'compile_' + lang,
-					'$%s $%s_FLAGS ${opts} -MMD -MT $out -MF $out.d -c $in -o $out' % (var_prefix, var_prefix),
+					join_opts('$%s $%s_FLAGS' % (var_prefix, var_prefix), debug_info_object_opts.get(self.debug_info),
+						'${opts} -MMD -MT $out -MF $out.d -c $in -o $out'),
 					'compile(%s) $out' % lang, self._compiler_variables,
-					depfile = '$out.d', deps = 'gcc'),
+					depfile = '$out.d', deps = 'gcc', **compile_params),
 				Rule((lang, 'exe'), 'compile_link_exe_' + lang,
-					'$%s $%s_FLAGS ${opts} -MMD -MT $out -MF $out.d $in -o $out' % (var_prefix, var_prefix),
+					'$%s $%s_FLAGS -MMD -MT $out -MF $out.d $in ${opts} -o $out' % (var_prefix, var_prefix),
 					'compile+link(%s) $out' % lang, self._compiler_variables,
 					depfile = '$out.d', deps = 'gcc'),
 				Rule((lang, 'shared'), 'compile_link_shared_' + lang,
-					'$%s $%s_FLAGS ${opts} -shared -fPIC -MMD -MT $out -MF $out.d $in -o $out' % (var_prefix, var_prefix),
+					'$%s $%s_FLAGS -shared -fPIC -MMD -MT $out -MF $out.d $in ${opts} -o $out' % (var_prefix, var_prefix),
 					'compile+link(%s) $out' % lang, self._compiler_variables,
 					depfile = '$out.d', deps = 'gcc'),
 			],
@@ -1101,29 +2040,63 @@ class External_SimpleCompiler(External): # C family compiler
 			opts = ('-std=%s ' % value) + self._compiler_opts
 		self._compiler_variables[self._var_prefix + '_FLAGS'] = opts
 
+	def _check(self, value, get_check):
+		# a list of values is checked in a single batch and gives a list of results
+		cmd = [self._compiler]
+		if self._std:
+			cmd.append('-std=%s' % self._std)
+		cmd.extend(self._compiler_opts.split()) # the options are part of the cache key
+		is_batch = isinstance(value, (list, tuple))
+		if not is_batch:
+			value = [value]
+		result = run_compiler_checks(os.path.join(self._ctx.registry.basedir, check_cache_file_name),
+			run_process([self._compiler, '--version'])[0], cmd, check_exts[self._lang], list(map(get_check, value)))
+		if is_batch:
+			return result
+		return result[0]
+
+	def supports_flag(self, flag):
+		return self._check(flag, lambda flag: ('-Werror ' + flag, check_sources[self._lang]))
+
+	def has_header(self, header):
+		return self._check(header, lambda header: ('', '#include <%s>\n' % header + check_sources[self._lang]))
+
+	def compiles(self, snippet, opts = ''):
+		return self._check(snippet, lambda snippet: (opts, snippet))
+
 
 class External_gcc(External_SimpleCompiler):
-	def __init__(self, ctx, version = None, std = None, compiler = None, compiler_opts = None, ext_list = None):
+	def __init__(self, ctx, version = None, std = None, compiler = None, compiler_opts = None, ext_list = None,
+			lto = None, debug_info = None, load_profile = None):
 		compiler = (compiler or 'gcc')
 		compiler_opts = (compiler_opts or '-Wall -pedantic')
 		ext_list = (ext_list or ['.c'])
 		self._check_version(version, run_process([compiler, '--version'])[0].splitlines()[0].split()[-1])
 		External_SimpleCompiler.__init__(self, ctx, std = std, lang = 'c',
-			compiler = compiler, compiler_opts = compiler_opts, var_prefix = 'CC', ext_list = ext_list)
+			compiler = compiler, compiler_opts = compiler_opts, var_prefix = 'CC', ext_list = ext_list,
+			lto = lto, lto_opts = get_lto_opts('gcc', lto),
+			debug_info = debug_info, load_profile = load_profile)
 External_gcc.register_external('gcc')
 
 
 class External_gpp(External_SimpleCompiler):
-	def __init__(self, ctx, version = None, std = None, compiler = None, compiler_opts = None, ext_list = None):
+	def __init__(self, ctx, version = None, std = None, compiler = None, compiler_opts = None, ext_list = None,
+			lto = None, debug_info = None, modules = False, load_profile = None):
 		compiler = (compiler or 'g++')
 		compiler_opts = (compiler_opts or '-Wall -pedantic')
 		ext_list = (ext_list or ['.cpp', '.cxx', '.cc'])
 		self._check_version(version, run_process([compiler, '--version'])[0].splitlines()[0].split()[-1])
+		module_scan = None
+		if modules: # requires gcc 14 or later
+			module_scan = ('$CXX $CXX_FLAGS ${opts} -E -x c++ $in -MT $out -MD -MF $out.d ' +
+				'-fdeps-format=p1689r5 -fdeps-file=$out -fdeps-target=${object} -o $out.i', 'gcm.cache/%s.gcm', '-fmodules-ts')
 		External_SimpleCompiler.__init__(self, ctx, std = std, lang = 'cpp',
 			compiler = compiler, compiler_opts = compiler_opts,
 			var_prefix = 'CXX', ext_list = ext_list, req_input = {
 				'exe': [External_libstdcpp(ctx)], 'shared': [External_libstdcpp(ctx)],
-				'static': [External_libstdcpp(ctx)]})
+				'static': [External_libstdcpp(ctx)]},
+			lto = lto, lto_opts = get_lto_opts('gcc', lto),
+			debug_info = debug_info, module_scan = module_scan, load_profile = load_profile)
 
 	def get_latest(self):
 		return self._find_latest([
@@ -1136,29 +2109,39 @@ External_gpp.register_external('g++', 'gpp')
 
 
 class External_gfortran(External_SimpleCompiler):
-	def __init__(self, ctx, version = None, std = None, compiler = None, compiler_opts = None, ext_list = None):
+	def __init__(self, ctx, version = None, std = None, compiler = None, compiler_opts = None, ext_list = None,
+			lto = None, debug_info = None, modules = False):
 		compiler = (compiler or 'gfortran')
 		compiler_opts = (compiler_opts or '-Wall')
-		ext_list = (ext_list or ['.f'])
+		ext_list = (ext_list or (modules and ['.f', '.f90']) or ['.f']) # modules are mostly written in free-form sources
 		self._check_version(version, run_process([compiler, '--version'])[0].splitlines()[0].split()[-1])
+		module_scan = None
+		if modules: # the module files are written to the build directory (-cpp is required by -MMD)
+			module_scan = ('%s -t scan-fortran $in $out ${object}' % get_pyrate_cmd(), '%s.mod', '-cpp')
 		External_SimpleCompiler.__init__(self, ctx, std = std, lang = 'fortran',
-			compiler = compiler, compiler_opts = compiler_opts, var_prefix = 'F', ext_list = ext_list)
+			compiler = compiler, compiler_opts = compiler_opts, var_prefix = 'F', ext_list = ext_list,
+			lto = lto, lto_opts = get_lto_opts('gcc', lto),
+			debug_info = debug_info, module_scan = module_scan)
 External_gfortran.register_external('gfortran')
 
 
 class External_clang(External_SimpleCompiler):
-	def __init__(self, ctx, version = None, std = None, compiler = None, compiler_opts = None, ext_list = None):
+	def __init__(self, ctx, version = None, std = None, compiler = None, compiler_opts = None, ext_list = None,
+			lto = None, debug_info = None, load_profile = None):
 		compiler = (compiler or 'clang')
 		compiler_opts = (compiler_opts or '-Weverything -Wno-padded')
 		ext_list = (ext_list or ['.c'])
 		self._check_version(version, run_process([compiler, '--version'])[0].splitlines()[0].split()[2])
 		External_SimpleCompiler.__init__(self, ctx, std = std, lang = 'c',
-			compiler = compiler, compiler_opts = compiler_opts, var_prefix = 'CC', ext_list = ext_list)
+			compiler = compiler, compiler_opts = compiler_opts, var_prefix = 'CC', ext_list = ext_list,
+			lto = lto, lto_opts = get_lto_opts('llvm', lto),
+			debug_info = debug_info, load_profile = load_profile)
 External_clang.register_external('clang')
 
 
 class External_clangpp(External_SimpleCompiler):
-	def __init__(self, ctx, version = None, std = None, compiler = None, compiler_opts = None, ext_list = None):
+	def __init__(self, ctx, version = None, std = None, compiler = None, compiler_opts = None, ext_list = None,
+			lto = None, debug_info = None, load_profile = None):
 		compiler = (compiler or 'clang++')
 		compiler_opts = (compiler_opts or '-Weverything -Wno-padded')
 		ext_list = (ext_list or ['.cpp', '.cxx', '.cc'])
@@ -1167,7 +2150,9 @@ class External_clangpp(External_SimpleCompiler):
 			compiler = compiler, compiler_opts = compiler_opts,
 			var_prefix = 'CXX', ext_list = ext_list, req_input = {
 				'exe': [External_libstdcpp(ctx)], 'shared': [External_libstdcpp(ctx)],
-				'static': [External_libstdcpp(ctx)]})
+				'static': [External_libstdcpp(ctx)]},
+			lto = lto, lto_opts = get_lto_opts('llvm', lto),
+			debug_info = debug_info, load_profile = load_profile)
 
 	def get_latest(self):
 		return self._find_latest([
@@ -1177,6 +2162,19 @@ class External_clangpp(External_SimpleCompiler):
 External_clangpp.register_external('clang++', 'clangpp')
 
 
+def get_restat_cmd(cmd, implicit_output_exts = None):
+	# keep the timestamp of outputs with unchanged content - so ninja can skip the targets depending on them
+	# (the implicit outputs are named after $out with a different extension - see get_normed_name)
+	files = str.join(' ', ['$out'] + list(map(lambda ext: '$${stem}%s' % ext, implicit_output_exts or [])))
+	return ('stem=$out && stem=$${stem%%.*} && files="%s" && ' % files +
+		'for fn in $$files; do cp -p $$fn $$fn.prev 2> /dev/null || true; done && ' +
+		'{ %s || { ret=$$?; for fn in $$files; do rm -f $$fn.prev; done; exit $$ret; }; } && ' % cmd +
+		'for fn in $$files; do cmp -s $$fn $$fn.prev && touch -r $$fn.prev $$fn; rm -f $$fn.prev; done')
+
+# language: generated files next to the wrapper source (besides the compiled wrapper)
+swig_implicit_output_exts = {'python': ['.py'], 'perl5': ['.pm'], 'php7': ['.php']}
+
+
 class External_SWIG(External):
 	def __init__(self, ctx, version = None):
 		version_str = ''
@@ -1192,11 +2190,16 @@ class External_SWIG(External):
 		if context is None:
 			context = self._ctx
 		wrapper_ext = context.find_external(lang)
+		implicit_output_exts = list(swig_implicit_output_exts.get(lang, []))
+		if '-directors' in (swig_opts or ''): # header with the director classes
+			implicit_output_exts.append('.h')
 		swig_rule = Rule(('swig', 'c++'), 'swig_cpp_%s' % lang,
-			'swig -c++ -%s -I. ${opts} -module ${module_name} -o $out $in' % lang,
-			'swig(C++ -> %s) $out' % lang, {})
+			get_restat_cmd('swig -c++ -%s -I. ${opts} -module ${module_name} -MD -MF $out.d -o $out $in' % lang,
+				implicit_output_exts),
+			'swig(C++ -> %s) $out' % lang, {}, implicit_output_exts = implicit_output_exts,
+			depfile = '$out.d', deps = 'gcc', restat = 1)
 		wrapper_src = BuildTarget(get_normed_name(name, '.cpp'), swig_rule,
-			[InputFile(ifile)] + add_rule_vars(opts = swig_opts, module_name = name),
+			[context.registry.get_input_file(ifile)] + add_rule_vars(context.registry, opts = swig_opts, module_name = name),
 			on_use_inputs = {None: [SelfReference()]},
 			on_use_variables = wrapper_ext.on_use_variables, target_type = 'cpp')
 		return context.shared_library('_' + name, [wrapper_src, wrapper_ext] + (libs or []), **kwargs)
@@ -1247,18 +2250,23 @@ External_Python.register_external('python')
 class External_ROOT(SimpleExternal):
 	def __init__(self, ctx, version = None, build_helper = 'root-config', link_opts = ''):
 		self._check_version(version, run_process([build_helper, '--version'])[0].split()[-1].replace('/', '.'))
+		self._dict_implicit_output_exts = ['.h'] # the dictionary header (ROOT 5) or the precompiled module (ROOT 6)
+		if self.version >= 6:
+			self._dict_implicit_output_exts = ['_rdict.pcm']
 		SimpleExternal.__init__(self, ctx, link = run_process([build_helper, '--libs'])[0] + ' ' + link_opts,
 			compile_cpp = run_process([build_helper, '--cflags'])[0])
 		self._ctx = ctx
 
 	def dictionary(self, name, header_list = None, include_list = None, opts = None, context = None, **kwargs):
-		cint_rule = Rule(('c++.h', 'c++'), 'rootdict', 'rootcint -f $out ${include_opts} $in', 'rootcint $out', {})
+		cint_rule = Rule(('c++.h', 'c++'), 'rootdict',
+			get_restat_cmd('rootcint -f $out ${include_opts} $in', self._dict_implicit_output_exts),
+			'rootcint $out', {}, implicit_output_exts = self._dict_implicit_output_exts, restat = 1)
+		context = context or self._ctx
 		include_opts = []
 		if include_list:
-			include_opts = add_rule_vars(include_opts = str.join(' ', map(lambda dn: '-I%s' % dn, include_list)))
-		context = context or self._ctx
+			include_opts = add_rule_vars(context.registry, include_opts = str.join(' ', map(lambda dn: '-I%s' % dn, include_list)))
 		return BuildTarget(get_normed_name(name, '.cpp'), cint_rule,
-			context.force_build_source(header_list) + include_opts + add_rule_vars(opts = opts),
+			context.force_build_source(header_list) + include_opts + add_rule_vars(context.registry, opts = opts),
 			on_use_inputs = {None: [SelfReference()]},
 			on_use_variables = self.on_use_variables,
 			target_type = 'cpp', **kwargs)
@@ -1331,30 +2339,69 @@ Toolchain.available = {}
 
 class Toolchain_GCC(Toolchain):
 	def __init__(self, ctx, version = None, c_std = None, c_opts = None, cpp_std = None, cpp_opts = None,
-			fortran_std = None, fortran_opts = None, link_shared_opts = None, link_exe_opts = None):
+			fortran_std = None, fortran_opts = None, link_shared_opts = None, link_exe_opts = None,
+			lto = None, lto_jobs = 'auto', lto_pool_depth = None, debug_info = None,
+			linker = None, linker_threads = None, static_archive_mode = None, modules = False, load_profile = None):
 		Toolchain.__init__(self, ctx)
 
-		self.tools['linker'] = Delayed(External_link_gcc, ctx, link_shared_opts = link_shared_opts, link_exe_opts = link_exe_opts)
-		self.tools['c'] = Delayed(External_gcc, ctx, version = version, std = c_std, compiler_opts = c_opts)
-		self.tools['cpp'] = Delayed(External_gpp, ctx, version = version, std = cpp_std, compiler_opts = cpp_opts)
-		self.tools['fortran'] = Delayed(External_gfortran, ctx, version = version, std = fortran_std, compiler_opts = fortran_opts)
+		self.tools['linker'] = Delayed(External_link_gcc, ctx, link_shared_opts = link_shared_opts, link_exe_opts = link_exe_opts,
+			lto = lto, lto_jobs = lto_jobs, lto_pool_depth = lto_pool_depth, debug_info = debug_info,
+			linker = linker, linker_threads = linker_threads, static_archive_mode = static_archive_mode,
+			load_profile = load_profile)
+		self.tools['c'] = Delayed(External_gcc, ctx, version = version, std = c_std, compiler_opts = c_opts,
+			lto = lto, debug_info = debug_info, load_profile = load_profile)
+		self.tools['cpp'] = Delayed(External_gpp, ctx, version = version, std = cpp_std, compiler_opts = cpp_opts,
+			lto = lto, debug_info = debug_info, modules = modules, load_profile = load_profile)
+		self.tools['fortran'] = Delayed(External_gfortran, ctx, version = version, std = fortran_std, compiler_opts = fortran_opts,
+			lto = lto, debug_info = debug_info, modules = modules)
 Toolchain.available['gcc'] = Toolchain_GCC
 
 
 class Toolchain_LLVM(Toolchain):
 	def __init__(self, ctx, version = None, c_std = None, c_opts = None, cpp_std = None, cpp_opts = None,
-			link_shared_opts = None, link_exe_opts = None):
+			link_shared_opts = None, link_exe_opts = None,
+			lto = None, lto_pool_depth = None, thinlto_cache_dir = None, thinlto_cache_policy = None,
+			debug_info = None, linker = None, linker_threads = None, static_archive_mode = None, load_profile = None):
 		Toolchain.__init__(self, ctx)
 
-		self.tools['linker'] = Delayed(External_link_llvm, ctx, link_shared_opts = link_shared_opts, link_exe_opts = link_exe_opts)
-		self.tools['c'] = Delayed(External_clang, ctx, version = version, std = c_std, compiler_opts = c_opts)
-		self.tools['cpp'] = Delayed(External_clangpp, ctx, version = version, std = cpp_std, compiler_opts = cpp_opts)
+		linker_kwargs = {}
+		if thinlto_cache_dir:
+			linker_kwargs['thinlto_cache_dir'] = thinlto_cache_dir
+		if thinlto_cache_policy:
+			linker_kwargs['thinlto_cache_policy'] = thinlto_cache_policy
+		self.tools['linker'] = Delayed(External_link_llvm, ctx, link_shared_opts = link_shared_opts, link_exe_opts = link_exe_opts,
+			lto = lto, lto_pool_depth = lto_pool_depth, debug_info = debug_info,
+			linker = linker, linker_threads = linker_threads, static_archive_mode = static_archive_mode,
+			load_profile = load_profile, **linker_kwargs)
+		self.tools['c'] = Delayed(External_clang, ctx, version = version, std = c_std, compiler_opts = c_opts,
+			lto = lto, debug_info = debug_info, load_profile = load_profile)
+		self.tools['cpp'] = Delayed(External_clangpp, ctx, version = version, std = cpp_std, compiler_opts = cpp_opts,
+			lto = lto, debug_info = debug_info, load_profile = load_profile)
 Toolchain.available['llvm'] = Toolchain_LLVM
 
 ################################################################################
 # Platforms
 ################################################################################
 
+# install mode: {target type: install command} - the command is called with sources and destination
+# or with '-t <destination directory>' followed by the sources (batched installs)
+install_modes = {
+	'copy': {None: 'cp'},
+	'reflink': {None: 'cp --reflink=auto'}, # copy-on-write clone on filesystems supporting it (btrfs, xfs)
+	'hardlink': {None: 'ln -f'}, # requires the destination on the same filesystem
+	'compare': {None: 'install -C', 'static': 'install -C -m 644'}, # unchanged files are not touched
+}
+default_install_mode = 'copy' # used by the install rules of the platform
+install_restat_modes = ['compare'] # modes leaving unchanged destination files untouched
+
+
+def get_install_cmd(install_mode, target_type):
+	if install_mode not in install_modes:
+		raise Exception('Unknown install mode %s - available modes: %s' % (repr(install_mode),
+			str.join(', ', sorted(install_modes))))
+	return install_modes[install_mode].get(target_type, install_modes[install_mode][None])
+
+
 class Platform(object):
 	def __init__(self, name, extensions, install_paths, rules):
 		(self.name, self.extensions, self.install_paths, self.rules) = (name, extensions, install_paths, rules)
@@ -1388,18 +2435,67 @@ class Platform_linux(Platform):
 ################################################################################
 
 class BuildFileWriter(object):
-	def __init__(self, fn, default_fn):
+	def __init__(self, fn, default_fn, basedir = '.'):
 		if fn is None:
 			fn = default_fn
-		self._fn = fn
-		self._fp = open(self._fn, 'w')
+		self._fn = os.path.join(basedir, fn)
+		self._fp = StringIO()
+
+	def prepare(self, targets):
+		pass
+
+	def close(self, write = True): # only touch the output file if the content has changed
+		content = self._fp.getvalue()
+		if not write:
+			return content
+		if get_generation_cache() is not None:
+			get_generation_cache().outputs.add(os.path.abspath(self._fn))
+		if os.path.exists(self._fn):
+			with open(self._fn) as fp:
+				if fp.read() == content:
+					return content
+		with open(self._fn, 'w') as fp:
+			fp.write(content)
+		return content
 BuildFileWriter.available = {}
 
 
 class NinjaBuildFileWriter(BuildFileWriter):
-	def __init__(self, fn = None):
-		BuildFileWriter.__init__(self, fn, 'build.ninja')
+	def __init__(self, fn = None, basedir = '.'):
+		BuildFileWriter.__init__(self, fn, 'build.ninja', basedir)
 		self._vars = {}
+		self._pools = set()
+		self._pool_depths = read_pool_depths(os.path.dirname(self._fn))
+		(self._shared_fragments, self._fragment_users) = ({}, {})
+	def _get_fragment_groups(self, key, fragments):
+		# split the fragments into groups of consecutive fragments that are used by the same targets
+		groups = []
+		for fragment in fragments:
+			users = self._fragment_users.get((key, fragment))
+			if groups and users and (users == self._fragment_users.get((key, groups[-1][-1]))):
+				groups[-1].append(fragment)
+			else:
+				groups.append([fragment])
+		return list(map(lambda group: str.join(' ', group), groups))
+	def prepare(self, targets):
+		# fragments of build variables (eg. the flags of an external and the project defines) that are
+		# used by several targets are written once as file-scope variables and referenced by the targets
+		self._fragment_users = {}
+		for (idx, target) in enumerate(targets):
+			for key, fragments in target.get_build_variable_fragments().items():
+				for fragment in fragments:
+					if (fragment == fragment.strip()) and ('\n' not in fragment):
+						self._fragment_users.setdefault((key, fragment), set()).add(idx)
+		group_count = {}
+		for target in targets:
+			for key, fragments in target.get_build_variable_fragments().items():
+				for group in self._get_fragment_groups(key, fragments):
+					group_count[(key, group)] = group_count.get((key, group), 0) + 1
+		for ((key, group), count) in group_count.items():
+			var_name = '%s_%s' % (key, calc_hash([key, group]))
+			saving = count * (len(group) - len(var_name) - 3) - len(var_name) - len(group) - 4
+			if (count > 1) and (saving > 0):
+				self._shared_fragments[(key, group)] = var_name
 	def _write_var(self, key, value):
 		if self._vars.get(key) != value:
 			self._fp.write('%s = %s\n' % (key, value.strip()))
@@ -1408,9 +2504,19 @@ class NinjaBuildFileWriter(BuildFileWriter):
 		if (len(default_targets) == 1) and (default_targets[0].name == 'all'): # ninja's default rule is all
 			return
 		self._fp.write('default %s\n' % str.join(' ', map(lambda t: t.name, default_targets)))
+	def write_comment(self, comment):
+		self._fp.write('# %s\n' % comment)
+	def _write_pool(self, pool):
+		depth = pool.get_depth(self._pool_depths)
+		if (depth is not None) and (pool.name not in self._pools): # depth None: builtin pool (eg. console)
+			self._pools.add(pool.name)
+			self._fp.write('pool %s\n  depth = %d\n\n' % (pool.name, depth))
 	def write_rule(self, rule):
 		for key, value in sorted(rule.defaults.items()):
 			self._write_var(key, value)
+		for (key, value) in rule.params:
+			if isinstance(value, Pool):
+				self._write_pool(value)
 		self._fp.write('rule %s\n' % rule.name)
 		self._fp.write('  command = %s\n' % rule.cmd)
 		self._fp.write('  description = %s\n' % rule.desc)
@@ -1419,24 +2525,47 @@ class NinjaBuildFileWriter(BuildFileWriter):
 		self._fp.write('\n')
 	def write_target(self, target):
 		inputs = str.join(' ', map(lambda t: t.name, target.get_build_inputs()))
-		self._fp.write('build %s: %s %s' % (target.name, target.build_rule.name, inputs))
+		outputs = target.name
+		if target.get_implicit_outputs():
+			outputs += ' | %s' % str.join(' ', target.get_implicit_outputs())
+		variables = {}
+		for key, fragments in target.get_build_variable_fragments().items():
+			value_list = []
+			for group in self._get_fragment_groups(key, fragments):
+				var_name = self._shared_fragments.get((key, group))
+				if var_name: # the shared variable is written before its first use
+					self._write_var(var_name, group)
+					group = '${%s}' % var_name
+				value_list.append(group)
+			variables[key] = (' ' + str.join(' ', value_list)).strip()
+		self._fp.write('build %s: %s %s' % (outputs, target.build_rule.name, inputs))
 		if target.get_build_deps():
 			self._fp.write(' | %s' % str.join(' ', map(lambda t: t.name, target.get_build_deps())))
 		self._fp.write('\n')
-		for key_value in sorted(target.get_build_variables().items()):
+		for key_value in sorted(variables.items()):
 			self._fp.write('  %s = %s\n' % key_value)
 BuildFileWriter.available['ninja'] = NinjaBuildFileWriter
 
 
+def get_make_cmd(rule):
+	# GNU make writes the response file with the file function
+	params = dict(rule.params)
+	if rule.cmd and ('rspfile' in params):
+		return '$(file >%s,%s)%s && rm -f %s' % (params['rspfile'], params['rspfile_content'], rule.cmd, params['rspfile'])
+	return rule.cmd
+
+
 class MakefileWriter(BuildFileWriter):
-	def __init__(self, fn = None):
-		BuildFileWriter.__init__(self, fn, 'Makefile')
+	def __init__(self, fn = None, basedir = '.'):
+		BuildFileWriter.__init__(self, fn, 'Makefile', basedir)
 		self._vars = set()
 	def _write_var(self, key, value):
 		self._fp.write('%s := %s\n' % (key, value.strip()))
 	def write_default(self, default_targets, all_targets):
-		all_targets = filter(lambda t: t.build_rule != phony_rule, all_targets)
-		self._fp.write('clean:\n\t@rm -f %s\n' % str.join(' ', map(lambda t: t.name, all_targets)))
+		clean_list = []
+		for target in filter(lambda t: t.build_rule != phony_rule, all_targets):
+			clean_list.extend([target.name] + target.get_implicit_outputs())
+		self._fp.write('clean:\n\t@rm -f %s\n' % str.join(' ', clean_list))
 		default = default_targets[0].name
 		if len(default_targets) > 1:
 			default = 'default_target'
@@ -1466,7 +2595,7 @@ class MakefileWriter(BuildFileWriter):
 			depfile = replace_var(rule_params['depfile'], 'out', target.name)
 			self._fp.write('-include %s\n' % depfile)
 		self._fp.write('%s: %s\n' % (target.name, str.join(' ', deps)))
-		cmd = replace_var(replace_var(target.build_rule.cmd, 'out', target.name), 'in', str.join(' ', inputs))
+		cmd = replace_var(replace_var(get_make_cmd(target.build_rule), 'out', target.name), 'in', str.join(' ', inputs))
 		for opt in sorted(target.build_rule.defaults.keys(), key = len, reverse = True):
 			cmd = replace_var_ref(cmd, opt, opt)
 		for opt in sorted(variables.keys(), key = len, reverse = True):
@@ -1479,12 +2608,1207 @@ class MakefileWriter(BuildFileWriter):
 BuildFileWriter.available['makefile'] = MakefileWriter
 
 
-def process_build_output(name, targets, rules, default_targets, ofn = None):
+class CompactMakefileWriter(MakefileWriter):
+	def __init__(self, fn = None, basedir = '.'):
+		MakefileWriter.__init__(self, fn, basedir)
+		self._var_index = {}
+		self._group_count = 0
+		self._rule_order = []
+		self._targets_by_rule = {}
+		self._fp.write('MAKEFLAGS += -r\n.SUFFIXES:\nin = $^\n\n')
+
+	def _translate(self, value):
+		def translate_var(match):
+			name = match.group(1) or match.group(2)
+			if name is None:
+				return '$$'
+			return {'out': '$@', 'in': '$(in)'}.get(name, '$(%s)' % name)
+		return re.sub(r'\$\{(\w+)\}|\$(\w+)|\$\$', translate_var, value)
+
+	def _get_var_ref(self, key, value):
+		# structural index of all target variables - each distinct value is only written once
+		var_name = self._var_index.get((key, value))
+		if var_name is None:
+			var_name = '%s_%d' % (key, len(self._var_index))
+			self._var_index[(key, value)] = var_name
+			self._write_var(var_name, value)
+		return '$(%s)' % var_name
+
+	def write_rule(self, rule):
+		if rule.defaults:
+			MakefileWriter.write_rule(self, rule)
+
+	def write_target(self, target):
+		rule = target.build_rule
+		if rule not in self._targets_by_rule:
+			self._rule_order.append(rule)
+		self._targets_by_rule.setdefault(rule, []).append(target)
+
+	def _get_pattern(self, target_name, input_name):
+		(out_root, out_ext) = os.path.splitext(target_name)
+		(in_root, in_ext) = os.path.splitext(input_name)
+		stem_len = 0
+		while (stem_len < min(len(out_root), len(in_root))) and (out_root[-stem_len - 1] == in_root[-stem_len - 1]):
+			stem_len += 1
+		if stem_len and ('%' not in target_name + input_name):
+			return '%s%%%s: %s%%%s' % (out_root[:-stem_len], out_ext, in_root[:-stem_len], in_ext)
+
+	def _write_group(self, rule, target_names, pattern, cmd, var_defs):
+		group_var = '%s_targets_%d' % (rule.name, self._group_count)
+		self._group_count += 1
+		self._fp.write('%s := %s\n' % (group_var, str.join(' ', target_names)))
+		self._fp.write('$(%s): %s\n\t%s\n' % (group_var, pattern, cmd))
+		for var_def in var_defs:
+			self._fp.write('$(%s): %s\n' % (group_var, var_def))
+		return '$(%s)' % group_var
+
+	def _write_rule_targets(self, rule, target_list):
+		rule_params = dict(rule.params)
+		depfile = None
+		if rule_params.get('deps') == 'gcc':
+			depfile = self._translate(rule_params['depfile']).replace('$@', '%')
+		cmd = self._translate(get_make_cmd(rule))
+		names_by_group = {}
+		group_order = []
+		explicit_targets = []
+		for target in target_list:
+			inputs = list(map(lambda t: t.name, target.get_build_inputs()))
+			deps = list(map(lambda t: t.name, target.get_build_deps()))
+			var_defs = []
+			for (key, value) in sorted(target.get_build_variables().items()):
+				var_defs.append('private %s = %s' % (key, self._get_var_ref(key, value)))
+			pattern = None
+			if rule.cmd and (len(inputs) == 1) and not deps:
+				pattern = self._get_pattern(target.name, inputs[0])
+			if pattern:
+				group_key = (pattern, tuple(var_defs))
+				if group_key not in names_by_group:
+					group_order.append(group_key)
+				names_by_group.setdefault(group_key, []).append((target.name, inputs, deps, var_defs))
+			else:
+				explicit_targets.append((target.name, inputs, deps, var_defs))
+		self._fp.write('# rule %s\n' % rule.name)
+		group_refs = []
+		for group_key in group_order:
+			if len(names_by_group[group_key]) < 2: # avoid repeating the recipe for single targets
+				explicit_targets.extend(names_by_group[group_key])
+				continue
+			group_refs.append(self._write_group(rule, list(map(lambda entry: entry[0], names_by_group[group_key])),
+				group_key[0], cmd.replace('$(in)', '$<'), group_key[1]))
+		if explicit_targets and rule.cmd:
+			group_refs.append(self._write_group(rule, list(map(lambda entry: entry[0], explicit_targets)),
+				'%:', cmd, []))
+		names_by_prereqs = {}
+		names_by_variable = {}
+		for (name, inputs, deps, var_defs) in explicit_targets:
+			if deps or (depfile and (len(inputs) != 1)):
+				self._fp.write('%s: private in := %s\n' % (name, str.join(' ', inputs)))
+			elif depfile: # depfile prerequisites are appended to $^
+				names_by_variable.setdefault('private in = $<', []).append(name)
+			for var_def in var_defs:
+				names_by_variable.setdefault(var_def, []).append(name)
+			names_by_prereqs.setdefault(str.join(' ', inputs + deps), []).append(name)
+		for entries_by_value in [names_by_variable, names_by_prereqs]:
+			for (value, names) in sorted(entries_by_value.items()):
+				self._fp.write('%s: %s\n' % (str.join(' ', names), value))
+		if depfile and group_refs:
+			self._fp.write('-include $(patsubst %%,%s,%s)\n' % (depfile, str.join(' ', group_refs)))
+		self._fp.write('\n')
+
+	def write_default(self, default_targets, all_targets):
+		for rule in self._rule_order:
+			self._write_rule_targets(rule, self._targets_by_rule[rule])
+		phony_targets = self._targets_by_rule.get(phony_rule, [])
+		if phony_targets:
+			self._fp.write('.PHONY: %s\n' % str.join(' ', map(lambda t: t.name, phony_targets)))
+		MakefileWriter.write_default(self, default_targets, all_targets)
+BuildFileWriter.available['makefile-compact'] = CompactMakefileWriter
+
+
+def process_build_output(name, targets, rules, default_targets, ofn = None, basedir = '.', write = True):
 	name = name.lower()
-	writer = BuildFileWriter.available[name](ofn)
+	writer = BuildFileWriter.available[name](ofn, basedir)
+	writer.prepare(targets)
 	list(map(writer.write_rule, filter(lambda r: r != phony_rule, rules)))
 	list(map(writer.write_target, targets))
 	writer.write_default(default_targets, targets)
+	return writer.close(write)
+
+################################################################################
+# Build telemetry
+################################################################################
+
+pyrate_script = os.path.abspath(__file__)
+rusage_log_name = '.pyrate_rusage'
+pool_depth_file_name = '.pyrate_pools'
+
+
+def get_pyrate_cmd():
+	return os.environ.get('PYRATE_CMD') or ('%s %s' % (sys.executable, pyrate_script))
+
+
+def use_rspfile(rule):
+	# the command is passed in a response file written by the build system - so the expanded
+	# variables are never quoted again by the wrappers; returns the command running the response file
+	params = dict(rule.params)
+	if 'rspfile' not in params:
+		params.update(rspfile = '$out.cmd', rspfile_content = rule.cmd)
+		rule.params = sorted(params.items())
+		rule.cmd = 'sh $out.cmd'
+	return rule.cmd
+
+
+def get_rusage_cmd(rule):
+	# wrap the command to record the used resources in the rusage log
+	return '%s -t rusage %s $out -- %s' % (get_pyrate_cmd(), rusage_log_name, use_rspfile(rule))
+
+
+def tool_rusage(log_fn, output, *cmd):
+	import resource, subprocess, time
+	t_start = time.time()
+	ret = subprocess.call(list(cmd[1:])) # cmd = ['--', <command>...]
+	t_end = time.time()
+	usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+	fp = open(log_fn, 'a')
+	fp.write('%s\t%.3f\t%.3f\t%.3f\t%d\n' % (output, t_start, t_end, usage.ru_utime + usage.ru_stime, usage.ru_maxrss))
+	fp.close()
+	return ret
+
+
+load_benchmark_lib_source = """#ifndef PYRATE_EXPORT
+#define PYRATE_EXPORT
+#endif
+%(functions)s
+static int (*lib%(idx)d_table[])(int) = {%(table)s};
+PYRATE_EXPORT int lib%(idx)d_entry(int x) {
+	unsigned int i;
+	for (i = 0; i < sizeof(lib%(idx)d_table) / sizeof(lib%(idx)d_table[0]); i++)
+		x = lib%(idx)d_table[i](x);
+	return x;
+}
+"""
+load_benchmark_main_source = """#include <dlfcn.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+#include <unistd.h>
+%(declarations)s
+static double get_time(void) {
+	struct timespec t;
+	clock_gettime(CLOCK_MONOTONIC, &t);
+	return t.tv_sec * 1e3 + t.tv_nsec * 1e-6;
+}
+int main(int argc, char **argv) {
+	double t_main = get_time(), t_end;
+	char t_exec[32];
+	int x = 0;
+	if (!getenv("PYRATE_EXEC_TIME")) { /* run again to measure the time from exec until main is reached */
+		sprintf(t_exec, "%%.6f", get_time());
+		setenv("PYRATE_EXEC_TIME", t_exec, 1);
+		execv(argv[0], argv);
+		perror(argv[0]);
+		return 1;
+	}
+%(calls)s
+	t_end = get_time();
+	printf("%%.3f %%.3f %%d\\n", t_main - atof(getenv("PYRATE_EXEC_TIME")), t_end - t_main, x);
+	return 0;
+}
+"""
+# the libraries are loaded with lazy binding - so only libraries linked with -z now resolve all symbols at load time
+load_benchmark_dlopen_calls = """	{
+		int idx;
+		for (idx = 1; idx < argc; idx++) {
+			char entry[64];
+			void *lib = dlopen(argv[idx], RTLD_LAZY | RTLD_LOCAL);
+			if (!lib) {
+				fprintf(stderr, "%s\\n", dlerror());
+				return 1;
+			}
+			sprintf(entry, "lib%d_entry", idx - 1);
+			x += ((int (*)(int))dlsym(lib, entry))(idx);
+		}
+	}"""
+
+
+def tool_load_benchmark(*args):
+	# measure the time to start an executable that is linked against (or with --dlopen: loads) shared libraries
+	# built with the given load profiles
+	import shutil, subprocess, tempfile, time
+	dlopen = '--dlopen' in args
+	args = list(filter(lambda arg: arg != '--dlopen', args))
+	(lib_count, function_count, runs) = list(map(int, args[:3])) + [200, 100, 20][len(args[:3]):]
+	profiles = list(args[3:] or ['off'] + sorted(load_profiles))
+	tmp_dn = tempfile.mkdtemp(prefix = 'pyrate_load_benchmark_')
+	try:
+		for profile in profiles:
+			dn = os.path.join(tmp_dn, profile)
+			os.mkdir(dn)
+			for idx in range(lib_count):
+				functions = ''
+				for fidx in range(function_count):
+					functions += 'int lib%d_value%d = %d;\n' % (idx, fidx, fidx)
+					functions += 'int lib%d_func%d(int x) { return x + lib%d_value%d; }\n' % (idx, fidx, idx, fidx)
+				table = str.join(', ', map(lambda fidx: 'lib%d_func%d' % (idx, fidx), range(function_count)))
+				with open(os.path.join(dn, 'lib%d.c' % idx), 'w') as fp:
+					fp.write(load_benchmark_lib_source % {'idx': idx, 'functions': functions, 'table': table})
+			(declarations, calls) = ('', load_benchmark_dlopen_calls)
+			if not dlopen:
+				declarations = str.join('', map(lambda idx: 'int lib%d_entry(int);\n' % idx, range(lib_count)))
+				calls = str.join('\n', map(lambda idx: '\tx += lib%d_entry(%d);' % (idx, idx + 1), range(lib_count)))
+			with open(os.path.join(dn, 'main.c'), 'w') as fp:
+				fp.write(load_benchmark_main_source % {'declarations': declarations, 'calls': calls})
+			with open(os.path.join(dn, 'build.py'), 'w') as fp:
+				fp.write('libs = []\nfor idx in range(%d):\n' % lib_count)
+				fp.write("\tlibs.append(shared_library('lib%%d' %% idx, ['lib%%d.c' %% idx], load_profile = %r))\n" % profile)
+				if dlopen:
+					fp.write("executable('load_benchmark', 'main.c', linker_opts = '-ldl')\n")
+				else:
+					fp.write("executable('load_benchmark', ['main.c'] + libs, linker_opts = %r)\n" %
+						join_opts('-Wl,-rpath,' + dn, get_load_profile_opts(profile)[1]))
+			generate(os.path.join(dn, 'build.py'), output = True)
+			if subprocess.call(['ninja', '-C', dn], stdout = subprocess.PIPE):
+				return 1
+			cmd = [os.path.join(dn, 'load_benchmark')]
+			if dlopen:
+				cmd.extend(map(lambda idx: os.path.join(dn, 'lib%d.so' % idx), range(lib_count)))
+			(t_process_list, t_main_list, t_calls_list) = ([], [], [])
+			for run in range(runs):
+				t_start = time.time()
+				output = run_process(cmd)[0].split()
+				t_process_list.append((time.time() - t_start) * 1e3)
+				t_main_list.append(float(output[0]))
+				t_calls_list.append(float(output[1]))
+			median = lambda values: sorted(values)[len(values) // 2]
+			size = sum(map(lambda idx: os.path.getsize(os.path.join(dn, 'lib%d.so' % idx)), range(lib_count)))
+			sys.stdout.write('%-10s process %8.3f ms  exec to main %8.3f ms  %s %8.3f ms  library size %8d kB\n' % (
+				profile, median(t_process_list), median(t_main_list), dlopen and 'dlopen+calls' or 'first calls',
+				median(t_calls_list), size // 1024))
+	finally:
+		shutil.rmtree(tmp_dn)
+
+
+def run_tool(args):
+	tools = {'rusage': tool_rusage, 'scan-fortran': tool_scan_fortran, 'collate-modules': tool_collate_modules,
+		'load-benchmark': tool_load_benchmark, 'cache': tool_cache, 'cache-stats': tool_cache_stats}
+	if (not args) or (args[0] not in tools):
+		sys.stderr.write('Unknown tool - available tools: %s\n' % str.join(', ', sorted(tools)))
+		return os.EX_USAGE
+	return tools[args[0]](*args[1:])
+
+
+def read_ninja_log(fn):
+	# returns the timing of the last build and the last known timing of each output (in seconds)
+	(last_run, timing_by_output) = ([], {})
+	if not os.path.exists(fn):
+		return (last_run, timing_by_output)
+	last_end = None
+	for line in open(fn):
+		if line.startswith('#'):
+			continue
+		fields = line.rstrip('\n').split('\t') # start, end, mtime, output, command hash
+		(start, end, output) = (fields[0], fields[1], fields[3])
+		(start, end) = (int(start) / 1000., int(end) / 1000.)
+		if (last_end is not None) and (end < last_end): # ninja restarted
+			last_run = []
+		last_end = end
+		last_run.append((start, end, output))
+		timing_by_output[output] = (start, end)
+	return (last_run, timing_by_output)
+
+
+def read_rusage_log(fn):
+	usage_by_output = {}
+	if os.path.exists(fn):
+		for line in open(fn):
+			(output, t_start, t_end, cpu, maxrss) = line.split('\t')
+			usage_by_output[output] = (float(cpu), int(maxrss))
+	return usage_by_output
+
+
+def read_pool_depths(dn):
+	import json
+	fn = os.path.join(dn, pool_depth_file_name)
+	if os.path.exists(fn):
+		return json.load(open(fn))
+	return {}
+
+
+def calc_critical_path(targets, duration_by_name):
+	target_by_name = dict(map(lambda t: (t.name, t), targets))
+	finish_by_name = {}
+	prev_by_name = {}
+	def get_finish(name): # finish time of the target in a build with infinite parallelism
+		if name not in finish_by_name:
+			finish_by_name[name] = 0 # break dependency cycles
+			target = target_by_name[name]
+			(prev, prev_finish) = (None, 0)
+			for src in target.get_build_inputs() + target.get_build_deps():
+				if (src.name in target_by_name) and (src.name != name):
+					src_finish = get_finish(src.name)
+					if src_finish > prev_finish:
+						(prev, prev_finish) = (src.name, src_finish)
+			prev_by_name[name] = prev
+			finish_by_name[name] = prev_finish + duration_by_name.get(name, 0)
+		return finish_by_name[name]
+	for name in sorted(target_by_name):
+		get_finish(name)
+	path = []
+	name = None
+	if finish_by_name:
+		name = max(sorted(finish_by_name), key = lambda name: finish_by_name[name])
+	while name is not None:
+		path.insert(0, name)
+		name = prev_by_name[name]
+	return path
+
+
+def calc_pool_depths(targets, usage_by_output):
+	import multiprocessing
+	mem_total = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+	maxrss_by_pool = {}
+	for target in targets:
+		for (key, value) in target.build_rule.params:
+			if isinstance(value, Pool) and (target.name in usage_by_output):
+				maxrss = usage_by_output[target.name][1] * 1024
+				maxrss_by_pool[value.name] = max(maxrss_by_pool.get(value.name, 0), maxrss)
+	result = {}
+	for (pool_name, maxrss) in maxrss_by_pool.items(): # limit the number of jobs that fit into memory
+		result[pool_name] = max(1, min(multiprocessing.cpu_count(), int(mem_total / max(maxrss, 1))))
+	return result
+
+
+def write_chrome_trace(fn, last_run, rule_by_name, usage_by_output):
+	import json
+	(events, lane_ends) = ([], [])
+	for (start, end, output) in sorted(last_run):
+		lane = 0
+		while (lane < len(lane_ends)) and (lane_ends[lane] > start): # find free lane
+			lane += 1
+		if lane == len(lane_ends):
+			lane_ends.append(end)
+		lane_ends[lane] = end
+		event = {'name': output, 'cat': rule_by_name.get(output, 'unknown'), 'ph': 'X', 'pid': 0, 'tid': lane,
+			'ts': int(start * 1e6), 'dur': int((end - start) * 1e6), 'args': {}}
+		if output in usage_by_output:
+			event['args'] = {'cpu': usage_by_output[output][0], 'maxrss': usage_by_output[output][1]}
+		events.append(event)
+	fp = open(fn, 'w')
+	json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp, sort_keys = True)
+	fp.close()
+
+
+def write_build_report(targets, dn, trace_fn = None, report_limit = 20, fp = sys.stdout):
+	import json
+	(last_run, timing_by_output) = read_ninja_log(os.path.join(dn, '.ninja_log'))
+	usage_by_output = read_rusage_log(os.path.join(dn, rusage_log_name))
+	if not timing_by_output:
+		sys.stderr.write('No build log found in %s - please run ninja first\n' % os.path.abspath(dn))
+		return
+	duration_by_name = {}
+	for (output, (start, end)) in timing_by_output.items():
+		duration_by_name[output] = end - start
+	rule_by_name = dict(map(lambda t: (t.name, t.build_rule.name), targets))
+	critical_path = calc_critical_path(targets, duration_by_name)
+	critical_time = sum(map(lambda name: duration_by_name.get(name, 0), critical_path))
+	if last_run:
+		fp.write('wall clock time (last build): %8.3f s\n' % (max(map(lambda e: e[1], last_run)) - min(map(lambda e: e[0], last_run))))
+	fp.write('critical path time:           %8.3f s\n' % critical_time)
+
+	def write_table(title, name_list):
+		fp.write('\n%s\n' % title)
+		fp.write('%10s %7s %10s %10s  %-24s %s\n' % ('time[s]', 'share', 'cpu[s]', 'maxrss[kB]', 'rule', 'target'))
+		for name in name_list:
+			duration = duration_by_name.get(name, 0)
+			(cpu, maxrss) = usage_by_output.get(name, ('-', '-'))
+			if usage_by_output.get(name):
+				cpu = '%.3f' % cpu
+			fp.write('%10.3f %6.1f%% %10s %10s  %-24s %s\n' % (duration, 100 * duration / max(critical_time, 1e-9),
+				cpu, maxrss, rule_by_name.get(name, 'unknown'), name))
+	write_table('critical path:', filter(lambda name: name in duration_by_name, critical_path))
+	ranking = sorted(duration_by_name, key = lambda name: (-duration_by_name[name], name))
+	write_table('slowest targets:', ranking[:report_limit])
+
+	pool_depths = calc_pool_depths(targets, usage_by_output)
+	if pool_depths:
+		fp.write('\npool depths (used by pools with depth = auto):\n')
+		for (pool_name, depth) in sorted(pool_depths.items()):
+			fp.write('  %s = %d\n' % (pool_name, depth))
+		pool_fp = open(os.path.join(dn, pool_depth_file_name), 'w')
+		json.dump(pool_depths, pool_fp, sort_keys = True)
+		pool_fp.close()
+	if trace_fn:
+		write_chrome_trace(trace_fn, last_run, rule_by_name, usage_by_output)
+
+################################################################################
+# Artifact cache
+################################################################################
+
+artifact_cache_version = 1
+artifact_cache_rule_prefixes = ('compile_', 'link_')
+# the outputs of commands with these options depend on data outside of the command inputs
+artifact_cache_uncacheable_opts = ['-fprofile-use', '-fprofile-instr-use', '-fauto-profile']
+artifact_cache_cleanup_interval = 60 # minimal time in seconds between two checks of the cache size
+artifact_cache_manifest_limit = 16 # number of header combinations kept for each command
+
+
+def parse_size(value):
+	units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+	value = str(value).strip().upper()
+	if value[-1:] in units:
+		return int(float(value[:-1]) * units[value[-1]])
+	return int(value)
+
+
+def enable_artifact_cache(rules, targets, cache_dn, max_size):
+	# wrap the compile and link commands to restore their outputs from the cache
+	cached_rules = list(filter(lambda rule: rule.cmd and rule.name.startswith(artifact_cache_rule_prefixes) and
+		not rule.module_rules, rules))
+	cached_rule_names = set(map(lambda rule: rule.name, cached_rules))
+	for target in targets: # implicit dependencies (eg. linked shared libraries) are not part of $in
+		if (target.build_rule.name in cached_rule_names) and target.get_build_deps():
+			target.build_src.append(BuildSource(on_use_variables = {None: {
+				'cache_deps': list(map(lambda t: t.name, target.get_build_deps()))}}))
+	for rule in cached_rules: # the command is read from the response file
+		use_rspfile(rule)
+		# the tool variables (eg. CXX = ccache g++) name the executables that identify the tool version
+		tool_vars = list(map(lambda key: '$' + key, filter(lambda key: not key.endswith('_FLAGS'), sorted(rule.defaults))))
+		rule.cmd = "%s -t cache '%s' %d '$out' '%s' '%s' '$in' '${cache_deps}' '%s' %s" % (get_pyrate_cmd(),
+			cache_dn, parse_size(max_size), str.join(',', rule.implicit_output_exts),
+			dict(rule.params).get('depfile', ''), str.join(' ', tool_vars), dict(rule.params)['rspfile'])
+
+
+def get_artifact_cache_path(cache_dn, kind, key):
+	return os.path.join(cache_dn, kind, key[:2], key)
+
+
+def write_artifact_cache_file(fn, data):
+	# files are written atomically - the cache can be shared between concurrent builds
+	import tempfile
+	if not os.path.exists(os.path.dirname(fn)):
+		try:
+			os.makedirs(os.path.dirname(fn))
+		except OSError: # created by a concurrent build
+			pass
+	(tmp_fd, tmp_fn) = tempfile.mkstemp(dir = os.path.dirname(fn), prefix = '.tmp')
+	try:
+		os.write(tmp_fd, data)
+		os.close(tmp_fd)
+		os.rename(tmp_fn, fn)
+	except (IOError, OSError):
+		os.remove(tmp_fn)
+		raise
+
+
+def read_artifact_cache_json(fn, default):
+	import json
+	try:
+		result = json.load(open(fn))
+		os.utime(fn, None) # used for the LRU eviction
+		return result
+	except (IOError, OSError, ValueError):
+		return default
+
+
+def store_artifact(cache_dn, data):
+	import hashlib
+	key = hashlib.sha256(data).hexdigest()
+	fn = get_artifact_cache_path(cache_dn, 'objects', key)
+	if os.path.exists(fn):
+		os.utime(fn, None)
+	else:
+		write_artifact_cache_file(fn, data)
+	return key
+
+
+def restore_artifacts(cache_dn, result, outputs, depfile):
+	# returns the restored content of stdout and stderr - or None if the artifacts are incomplete
+	import shutil, tempfile
+	def get_object(key):
+		fn = get_artifact_cache_path(cache_dn, 'objects', key)
+		os.utime(fn, None)
+		return fn
+	try:
+		file_list = list(map(lambda entry: (get_object(entry[0]), entry[1]), result['outputs']))
+		if depfile:
+			file_list.append((get_object(result['depfile']), None))
+		streams = list(map(lambda key: open(get_object(key), 'rb').read(), [result['stdout'], result['stderr']]))
+	except (IOError, OSError, KeyError, TypeError):
+		return None
+	for (fn, (object_fn, mode)) in zip(outputs + [depfile], file_list):
+		(tmp_fd, tmp_fn) = tempfile.mkstemp(dir = os.path.dirname(fn) or '.', prefix = '.tmp')
+		os.close(tmp_fd)
+		try:
+			shutil.copyfile(object_fn, tmp_fn)
+			if mode is not None:
+				os.chmod(tmp_fn, mode)
+			os.rename(tmp_fn, fn)
+		except (IOError, OSError): # eg. evicted by a concurrent cleanup - the command is run instead
+			if os.path.exists(tmp_fn):
+				os.remove(tmp_fn)
+			return None
+	return streams
+
+
+def log_artifact_cache_result(cache_dn, result):
+	try:
+		if not os.path.exists(cache_dn):
+			os.makedirs(cache_dn)
+		fd = os.open(os.path.join(cache_dn, 'stats'), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 420)
+		os.write(fd, (result + '\n').encode('ascii'))
+		os.close(fd)
+	except (IOError, OSError): # the statistics are optional
+		pass
+
+
+def cleanup_artifact_cache(cache_dn, max_size):
+	# remove the least recently used files until the cache is reduced to 80% of its maximal size
+	import time
+	marker_fn = os.path.join(cache_dn, 'cleanup')
+	if os.path.exists(marker_fn) and (time.time() - os.path.getmtime(marker_fn) < artifact_cache_cleanup_interval):
+		return
+	open(marker_fn, 'w').close()
+	(file_list, total_size) = ([], 0)
+	for kind in ['objects', 'results', 'manifests']:
+		for (dn, dn_list, fn_list) in os.walk(os.path.join(cache_dn, kind)):
+			for fn in fn_list:
+				try:
+					fn_stat = os.stat(os.path.join(dn, fn))
+				except OSError:
+					continue
+				file_list.append((fn_stat.st_mtime, fn_stat.st_size, os.path.join(dn, fn)))
+				total_size += fn_stat.st_size
+	for (mtime, size, fn) in sorted(file_list):
+		if total_size <= max_size * 0.8:
+			break
+		try:
+			os.remove(fn)
+		except OSError:
+			pass
+		total_size -= size
+
+
+def tool_cache(cache_dn, max_size, output, implicit_output_exts, depfile, inputs, deps, tools, cmd_fn):
+	import hashlib, json, subprocess
+	cmd = open(cmd_fn).read().strip()
+	if list(filter(lambda opt: opt in cmd, artifact_cache_uncacheable_opts)):
+		return subprocess.call(cmd, shell = True)
+	file_hashes = {}
+	def get_file_hash(fn):
+		if fn not in file_hashes:
+			file_hashes[fn] = None
+			if os.path.isfile(fn):
+				file_hashes[fn] = hashlib.sha256(open(fn, 'rb').read()).hexdigest()
+		return file_hashes[fn]
+	def get_key(*values):
+		return hashlib.sha256(json.dumps(values, sort_keys = True).encode('utf-8')).hexdigest()
+	def get_executable_hash(executable): # the executable identifies the tool version
+		for dn in os.environ.get('PATH', '').split(os.pathsep):
+			if os.path.isfile(os.path.join(dn, executable)):
+				return get_file_hash(os.path.join(dn, executable))
+	executables = list(filter(lambda arg: not arg.startswith('-'), tools.split()))
+	input_list = sorted(set(inputs.split() + deps.split()))
+	base_key = get_key(artifact_cache_version, cmd, list(map(get_executable_hash, executables)),
+		list(map(lambda fn: [fn, get_file_hash(fn)], input_list)))
+	outputs = [output] + list(map(lambda ext: get_normed_name(output, ext), filter(None, implicit_output_exts.split(','))))
+	(stdout_fp, stderr_fp) = (getattr(sys.stdout, 'buffer', sys.stdout), getattr(sys.stderr, 'buffer', sys.stderr))
+
+	# the headers found in the depfile select the cache entry
+	manifest_fn = get_artifact_cache_path(cache_dn, 'manifests', base_key)
+	manifest = read_artifact_cache_json(manifest_fn, [])
+	for header_hashes in manifest:
+		if list(filter(lambda entry: get_file_hash(entry[0]) != entry[1], header_hashes)):
+			continue
+		result = read_artifact_cache_json(get_artifact_cache_path(cache_dn, 'results',
+			get_key(base_key, header_hashes)), None)
+		streams = result and restore_artifacts(cache_dn, result, outputs, depfile)
+		if streams:
+			stdout_fp.write(streams[0])
+			stderr_fp.write(streams[1])
+			log_artifact_cache_result(cache_dn, 'hit')
+			return 0
+	log_artifact_cache_result(cache_dn, 'miss')
+
+	p = subprocess.Popen(cmd, shell = True, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+	(stdout, stderr) = p.communicate()
+	stdout_fp.write(stdout)
+	stderr_fp.write(stderr)
+	if p.returncode or list(filter(lambda fn: not os.path.exists(fn), outputs + list(filter(None, [depfile])))):
+		return p.returncode
+	header_hashes = []
+	if depfile:
+		header_hashes = list(map(lambda fn: [fn, get_file_hash(fn)], sorted(set(read_depfile(depfile)))))
+	try: # a read-only or full cache does not fail the build
+		result = {'stdout': store_artifact(cache_dn, stdout), 'stderr': store_artifact(cache_dn, stderr),
+			'outputs': list(map(lambda fn: [store_artifact(cache_dn, open(fn, 'rb').read()), os.stat(fn).st_mode & 4095], outputs))}
+		if depfile:
+			result['depfile'] = store_artifact(cache_dn, open(depfile, 'rb').read())
+		write_artifact_cache_file(get_artifact_cache_path(cache_dn, 'results', get_key(base_key, header_hashes)),
+			json.dumps(result, sort_keys = True).encode('utf-8'))
+		if header_hashes not in manifest:
+			manifest = [header_hashes] + manifest[:artifact_cache_manifest_limit - 1]
+			write_artifact_cache_file(manifest_fn, json.dumps(manifest).encode('utf-8'))
+		cleanup_artifact_cache(cache_dn, int(max_size))
+	except (IOError, OSError):
+		pass
+	return 0
+
+
+def tool_cache_stats(cache_dn):
+	(hits, misses, size, files) = (0, 0, 0, 0)
+	stats_fn = os.path.join(cache_dn, 'stats')
+	if os.path.exists(stats_fn):
+		results = open(stats_fn).read().split()
+		(hits, misses) = (results.count('hit'), results.count('miss'))
+	for (dn, dn_list, fn_list) in os.walk(os.path.join(cache_dn, 'objects')):
+		for fn in fn_list:
+			size += os.path.getsize(os.path.join(dn, fn))
+			files += 1
+	sys.stdout.write('hits:     %8d\nmisses:   %8d\nhit rate: %7.1f%%\n' % (hits, misses, 100. * hits / max(hits + misses, 1)))
+	sys.stdout.write('objects:  %8d\nsize:     %8d kB\n' % (files, size // 1024))
+
+################################################################################
+# Test execution
+################################################################################
+
+# the output of the test is only shown if the test fails (or exceeds the timeout - 0 disables it)
+test_run_cmd = 'rm -f $out && env ${env} timeout ${timeout} %s ${args} > $out.log 2>&1 || ' +\
+	'{ cat $out.log; exit 1; }; touch $out'
+test_shard_env_prefixes = ['TEST_', 'GTEST_'] # the sharding variables of bazel and googletest
+
+
+def shell_quote(value):
+	if re.match(r'^[\w@%+=:,./-]+$', value):
+		return value
+	return "'%s'" % value.replace("'", "'\\''")
+
+################################################################################
+# Profile guided optimization
+################################################################################
+
+# pgo family: (instrumentation compiler options, instrumentation linker options,
+#   profile use compiler options, training command) - the commands of the training are given by 'training'
+pgo_families = {
+	# the profile prefix path (which has to be absolute) strips the variant directory from the profile names,
+	# so both variants use the same profile names
+	'gcc': ('-fprofile-generate=%(profile)s -fprofile-prefix-path=%(variant)s -fprofile-update=atomic', '-fprofile-generate',
+		'-fprofile-use=%(profile)s -fprofile-prefix-path=%(variant)s -fprofile-partial-training -Wno-missing-profile',
+		'rm -rf %(profile)s && %(training)s && touch $out'),
+	'llvm': ('-fprofile-generate', '-fprofile-generate', '-fprofile-use=%(profile)s.profdata -Wno-profile-instr-unprofiled',
+		'rm -rf %(profile)s && export LLVM_PROFILE_FILE=%(profile)s/%%p-%%m.profraw && %(training)s && ' +
+		'llvm-profdata merge -o %(profile)s.profdata %(profile)s/*.profraw && touch $out'),
+}
+bolt_instrument_cmd = 'llvm-bolt $in -instrument -instrumentation-file=%(profile)s/prof -instrumentation-file-append-pid -o $out'
+bolt_train_cmd = 'rm -rf %(profile)s && mkdir -p %(profile)s && %(training)s && merge-fdata %(profile)s/*.fdata > $out'
+bolt_optimize_cmd = 'llvm-bolt $in -data=${profile} -reorder-blocks=ext-tsp -reorder-functions=hfsort ' +\
+	'-split-functions -split-all-cold -dyno-stats -o $out'
+
+
+def probe_bolt():
+	try:
+		run_process(['llvm-bolt', '--version'])
+		return True
+	except ProcessError:
+		return False
+
+
+def clone_target_variant(registry, target, prefix, variant_input, clones = None):
+	# the objects and static libraries of the target are built again with the variant input
+	if clones is None:
+		clones = {}
+	if (not isinstance(target, BuildTarget)) or (target.target_type not in ['object', 'static', 'exe']):
+		return target
+	if id(target) not in clones:
+		def map_self(on_use_dict):
+			result = {}
+			for key, value_list in on_use_dict.items():
+				result[key] = list(map(lambda value: (value is target) and SelfReference() or value, value_list))
+			return result
+		build_src = list(map(lambda src: clone_target_variant(registry, src, prefix, variant_input, clones), target.build_src))
+		clones[id(target)] = registry.register_target(BuildTarget(os.path.join(prefix, target.name),
+			target.build_rule.clone(), build_src + variant_input,
+			on_use_inputs = map_self(target.on_use_inputs), on_use_deps = map_self(target.on_use_deps),
+			on_use_variables = target.on_use_variables, target_type = target.target_type,
+			install_name = target.install_name, user_name = target.user_name))
+	return clones[id(target)]
+
+################################################################################
+# Module dependencies
+################################################################################
+
+def get_module_rules(lang, var_prefix, scan_cmd, module_fn_format):
+	# the scan rule name starts with the compile rule name to receive the same rule variables (eg. include paths)
+	scan_params = {}
+	if scan_cmd.startswith('$%s ' % var_prefix): # the compiler also reports the included headers
+		scan_params = {'depfile': '$out.d', 'deps': 'gcc'}
+	scan_rule = Rule((lang, 'module_info'), 'compile_%s_scan' % lang, scan_cmd, 'scan(%s) $out' % lang, {},
+		**scan_params)
+	collate_rule = Rule(('module_info', 'dyndep'), 'collate_modules_%s' % lang,
+		"%s -t collate-modules $out '%s' $in" % (get_pyrate_cmd(), module_fn_format), 'collate(%s) $out' % lang, {},
+		restat = 1)
+	return (scan_rule, collate_rule)
+
+
+fortran_intrinsic_modules = ['iso_c_binding', 'iso_fortran_env', 'ieee_arithmetic', 'ieee_exceptions', 'ieee_features',
+	'omp_lib', 'omp_lib_kinds', 'openacc']
+
+
+def scan_fortran_modules(fp):
+	# returns the provided and required modules of a fortran source
+	re_module = re.compile(r'^\s*module\s+(\w+)\s*(!.*)?$', re.IGNORECASE)
+	re_submodule = re.compile(r'^\s*submodule\s*\(\s*(\w+)\s*(:\s*\w+\s*)?\)\s*(\w+)', re.IGNORECASE)
+	re_use = re.compile(r'^\s*use\s*(,\s*(non_)?intrinsic\s*)?(::)?\s*(\w+)', re.IGNORECASE)
+	(provides, requires) = ([], [])
+	for line in fp:
+		match_module = re_module.match(line)
+		if match_module and (match_module.group(1).lower() != 'procedure'):
+			provides.append(match_module.group(1).lower())
+		match_submodule = re_submodule.match(line)
+		if match_submodule:
+			requires.append(match_submodule.group(1).lower())
+		match_use = re_use.match(line)
+		if match_use and ((match_use.group(1) or '').strip(', ').lower() != 'intrinsic'):
+			if match_use.group(4).lower() not in fortran_intrinsic_modules:
+				requires.append(match_use.group(4).lower())
+	return (provides, list(filter(lambda name: name not in provides, requires)))
+
+
+def tool_scan_fortran(src, output, obj):
+	# write the module dependencies of a fortran source in the P1689 format
+	import json
+	(provides, requires) = scan_fortran_modules(open(src))
+	rule = {'primary-output': obj}
+	if provides:
+		rule['provides'] = list(map(lambda name: {'logical-name': name}, sorted(set(provides))))
+	if requires:
+		rule['requires'] = list(map(lambda name: {'logical-name': name}, sorted(set(requires))))
+	fp = open(output, 'w')
+	json.dump({'version': 1, 'revision': 0, 'rules': [rule]}, fp, indent = 1, sort_keys = True)
+	fp.close()
+
+
+def tool_collate_modules(output, module_fn_format, *scan_fn_list):
+	# write the ninja dyndep file connecting module providers and consumers (only touched on changes)
+	import json
+	(rule_list, provider_by_name) = ([], {})
+	for scan_fn in scan_fn_list:
+		for rule in json.load(open(scan_fn)).get('rules', []):
+			rule_list.append(rule)
+			for entry in rule.get('provides', []):
+				provider_by_name[entry['logical-name']] = rule['primary-output']
+	def get_module_fn(name):
+		return module_fn_format % name.replace(':', '-')
+	content = ['ninja_dyndep_version = 1']
+	for rule in rule_list:
+		line = 'build %s' % rule['primary-output']
+		provides = list(map(lambda entry: get_module_fn(entry['logical-name']), rule.get('provides', [])))
+		if provides:
+			line += ' | ' + str.join(' ', provides)
+		line += ': dyndep'
+		requires = filter(lambda entry: entry['logical-name'] in provider_by_name, rule.get('requires', []))
+		requires = list(map(lambda entry: get_module_fn(entry['logical-name']), requires)) # external modules are ignored
+		if requires:
+			line += ' | ' + str.join(' ', requires)
+		content.append(line)
+	content = str.join('\n', content) + '\n'
+	if os.path.exists(output) and (open(output).read() == content):
+		return
+	fp = open(output, 'w')
+	fp.write(content)
+	fp.close()
+
+
+def add_module_dependencies(rules, targets):
+	# objects of compilers with module support are scanned and ordered by a collated ninja dyndep file
+	rule_by_rhash = dict(map(lambda rule: (rule.get_hash(), rule), rules))
+	(objects_by_crhash, crhash_order) = ({}, [])
+	for target in list(targets):
+		if (target.target_type != 'object') or not target.build_rule.module_rules:
+			continue
+		crhash = target.build_rule.module_rules[1].get_hash()
+		if crhash not in objects_by_crhash:
+			crhash_order.append(crhash)
+		objects_by_crhash.setdefault(crhash, []).append(target)
+	for crhash in crhash_order:
+		object_list = objects_by_crhash[crhash]
+		(scan_rule, collate_rule) = object_list[0].build_rule.module_rules
+		(scan_rule, collate_rule) = map(lambda rule: rule_by_rhash.setdefault(rule.get_hash(), rule), [scan_rule, collate_rule])
+		scan_list = list(map(lambda obj: BuildTarget(obj.name + '.ddi', scan_rule,
+			obj.build_src + [RuleVariables({None: {'object': [obj.name]}})],
+			on_use_inputs = {None: [SelfReference()]}), object_list))
+		collate_target = BuildTarget(collate_rule.name + '.dd', collate_rule, scan_list)
+		for obj in object_list:
+			obj.build_src = obj.build_src + [BuildSource(on_use_deps = {None: [collate_target]},
+				on_use_variables = {None: {'dyndep': [collate_target.name]}})]
+		targets.extend(scan_list + [collate_target])
+	rules[:] = sorted(rule_by_rhash.values(), key = lambda r: r.name)
+
+################################################################################
+# Build graph sharding
+################################################################################
+
+def get_target_sources(target):
+	return list(filter(lambda src: isinstance(src, BuildTarget), target.get_build_inputs() + target.get_build_deps()))
+
+
+def split_shard_targets(targets, shard_count, cost_by_name):
+	# links, installs and everything depending on them end up in the final merge stage
+	merge_names = set()
+	for target in targets:
+		if (target.build_rule == phony_rule) or (target.target_type in ['exe', 'shared', 'static']):
+			merge_names.add(target.name)
+	changed = True
+	while changed:
+		changed = False
+		for target in targets:
+			if (target.name not in merge_names) and any(map(lambda src: src.name in merge_names, get_target_sources(target))):
+				merge_names.add(target.name)
+				changed = True
+	# connected targets (eg. generated source and its object file) are kept in the same shard
+	group_by_name = {}
+	def get_group(name):
+		while group_by_name.get(name, name) != name:
+			name = group_by_name[name]
+		return name
+	for target in filter(lambda t: t.name not in merge_names, targets):
+		group_by_name.setdefault(target.name, target.name)
+		for src in get_target_sources(target):
+			group_by_name[get_group(src.name)] = get_group(target.name)
+	targets_by_group = {}
+	for target in filter(lambda t: t.name not in merge_names, targets):
+		targets_by_group.setdefault(get_group(target.name), []).append(target)
+	def get_group_cost(group):
+		return sum(map(lambda t: cost_by_name.get(t.name, 1), targets_by_group[group]))
+	# distribute groups (most expensive first) to the shard with the smallest cost
+	(shard_list, shard_cost) = (list(map(lambda idx: [], range(shard_count))), [0] * shard_count)
+	for group in sorted(targets_by_group, key = lambda group: (-get_group_cost(group), group)):
+		idx = shard_cost.index(min(shard_cost))
+		shard_list[idx].extend(targets_by_group[group])
+		shard_cost[idx] += get_group_cost(group)
+	merge_list = list(filter(lambda t: t.name in merge_names, targets))
+	return (shard_list, shard_cost, merge_list)
+
+
+def write_shard_file(fn, header, targets, rules, default_targets = None, builddir = None):
+	writer = NinjaBuildFileWriter(fn)
+	stage_names = set(map(lambda t: t.name, targets))
+	required = set()
+	for target in targets:
+		required.update(map(lambda src: src.name, filter(lambda src: src.name not in stage_names, get_target_sources(target))))
+	writer.write_comment(header)
+	if required:
+		writer.write_comment('required outputs of other stages: %s' % str.join(' ', sorted(required)))
+	if builddir: # location of .ninja_log and .ninja_deps
+		writer._write_var('builddir', builddir)
+	used_rules = set(map(lambda t: t.build_rule, targets))
+	writer.prepare(targets)
+	list(map(writer.write_rule, filter(lambda r: (r != phony_rule) and (r in used_rules), rules)))
+	list(map(writer.write_target, targets))
+	if default_targets and all(map(lambda t: t.name in stage_names, default_targets)):
+		writer.write_default(default_targets, targets)
+	writer.close()
+
+
+def write_shards(targets, rules, default_targets, ofn, shard_count):
+	# each shard keeps its own ninja log - so the shards can run concurrently in the same directory
+	dn = os.path.dirname(ofn or 'build.ninja') or '.'
+	shard_builddirs = list(map(lambda idx: '.ninja_shard%d' % (idx + 1), range(shard_count)))
+	cost_by_name = {}
+	for builddir in ['.'] + shard_builddirs:
+		for (output, (start, end)) in read_ninja_log(os.path.join(dn, builddir, '.ninja_log'))[1].items():
+			cost_by_name[output] = end - start
+	(shard_list, shard_cost, merge_list) = split_shard_targets(targets, shard_count, cost_by_name)
+	fn_base = os.path.splitext(ofn or 'build.ninja')[0]
+	for (idx, shard_targets) in enumerate(shard_list):
+		write_shard_file('%s.shard%d.ninja' % (fn_base, idx + 1),
+			'shard %d/%d - %d targets, cost %.3f' % (idx + 1, shard_count, len(shard_targets), shard_cost[idx]),
+			shard_targets, rules, builddir = shard_builddirs[idx])
+	write_shard_file('%s.merge.ninja' % fn_base, 'merge stage - %d targets' % len(merge_list),
+		merge_list, rules, default_targets)
+
+################################################################################
+# Redundant source analysis
+################################################################################
+
+def get_object_consumers(targets):
+	# returns the distinct object targets (in order of appearance), the targets using them as direct input
+	# and all instances of each object - all indexed by the object hash
+	(object_list, consumers_by_hash, objects_by_hash, visited) = ([], {}, {}, set())
+	stack = list(reversed(targets))
+	while stack:
+		target = stack.pop()
+		if id(target) in visited:
+			continue
+		visited.add(id(target))
+		if target.target_type == 'object':
+			instances = objects_by_hash.setdefault(target.get_hash(), [])
+			if not instances:
+				object_list.append(target)
+			instances.append(target)
+		for src in reversed(target.build_src):
+			if isinstance(src, BuildTarget):
+				if src.target_type == 'object':
+					consumers = consumers_by_hash.setdefault(src.get_hash(), [])
+					if target not in consumers:
+						consumers.append(target)
+				stack.append(src)
+	return (object_list, consumers_by_hash, objects_by_hash)
+
+
+def get_compile_flags(target):
+	result = []
+	for key in sorted(target.build_rule.defaults):
+		if key.endswith('_FLAGS'):
+			result.extend(target.build_rule.defaults[key].split())
+	return result + target.get_build_variables().get('opts', '').split()
+
+
+def find_redundant_sources(object_list):
+	# returns {source: {(rule hash, flags): [objects]}} for sources that are compiled more than once
+	objects_by_flags_by_src = {}
+	for obj in object_list:
+		src = str.join(' ', map(lambda t: t.name, obj.get_build_inputs()))
+		flags = (obj.build_rule.get_hash(), tuple(get_compile_flags(obj)))
+		objects_by_flags_by_src.setdefault(src, {}).setdefault(flags, []).append(obj)
+	result = {}
+	for (src, objects_by_flags) in objects_by_flags_by_src.items():
+		if sum(map(len, objects_by_flags.values())) > 1:
+			result[src] = objects_by_flags
+	return result
+
+
+def get_consumer_list(objects, consumers_by_hash):
+	result = []
+	for obj in objects:
+		result.extend(filter(lambda t: t not in result, consumers_by_hash.get(obj.get_hash(), [])))
+	return result
+
+
+def write_redundancy_report(targets, fp = sys.stdout):
+	(object_list, consumers_by_hash, objects_by_hash) = get_object_consumers(targets)
+	redundant = find_redundant_sources(object_list)
+	def get_count(src):
+		return sum(map(len, redundant[src].values()))
+	fp.write('%d sources are compiled more than once (%d additional compilations)\n' %
+		(len(redundant), sum(map(lambda src: get_count(src) - 1, redundant))))
+	for src in sorted(redundant, key = lambda src: (-get_count(src), src)):
+		objects_by_flags = redundant[src]
+		fp.write('\n%s - compiled %d times with %d flag sets\n' % (src, get_count(src), len(objects_by_flags)))
+		flag_sets = list(map(lambda flags: flags[1], objects_by_flags))
+		common = set(flag_sets[0])
+		for flag_set in flag_sets[1:]:
+			common.intersection_update(flag_set)
+		for (flags, objects) in sorted(objects_by_flags.items(), key = lambda item: (-len(item[1]), item[0][1])):
+			diff = str.join(' ', filter(lambda flag: flag not in common, flags[1])) or '<common flags>'
+			consumers = sorted(map(lambda t: t.name, get_consumer_list(objects, consumers_by_hash)))
+			fp.write('   %dx %s (used by %s)\n' % (len(objects), diff, str.join(', ', consumers) or '-'))
+		fp.write('   common flags: %s\n' % str.join(' ', filter(lambda flag: flag in common, flag_sets[0])))
+
+
+def factor_redundant_sources(ctx, targets):
+	# objects with identical commands are merged into a single object linked by all their consumers - the object
+	# stays a direct input (a static library would drop members that are only needed for their static initializers)
+	(object_list, consumers_by_hash, objects_by_hash) = get_object_consumers(targets)
+	(merged_by_id, consumers_all) = ({}, [])
+	for objects_by_flags in find_redundant_sources(object_list).values():
+		for objects in objects_by_flags.values():
+			consumers = get_consumer_list(objects, consumers_by_hash)
+			if (len(objects) < 2) or any(map(lambda t: t.target_type not in ['exe', 'shared', 'static'], consumers)):
+				continue
+			merged = objects[0]
+			(inputs, variables, build_src) = (merged.get_build_inputs(), merged.get_build_variables(), merged.build_src)
+			for obj in objects[1:]: # dependencies of all merged objects are kept
+				merged.build_src = merged.build_src + list(filter(lambda src: src not in merged.build_src, obj.build_src))
+			if (merged.get_build_inputs() != inputs) or (merged.get_build_variables() != variables):
+				merged.build_src = build_src
+				continue
+			for obj in objects:
+				merged_by_id.update(dict.fromkeys(map(id, objects_by_hash[obj.get_hash()]), merged))
+			consumers_all.extend(filter(lambda t: t not in consumers_all, consumers))
+	unused = set(merged_by_id).difference(map(id, merged_by_id.values()))
+	ctx.registry.target_list = list(filter(lambda t: id(t) not in unused, ctx.registry.target_list))
+	for consumer in consumers_all: # the merged object takes the place of the replaced object
+		build_src = []
+		for src in map(lambda src: merged_by_id.get(id(src), src), consumer.build_src):
+			if src not in build_src:
+				build_src.append(src)
+		consumer.build_src = build_src
+
+################################################################################
+# Affected targets
+################################################################################
+
+def read_depfile(fn):
+	# returns the prerequisites of a make style dependency file
+	result = []
+	for line in open(fn).read().replace('\\\n', ' ').splitlines():
+		if ':' in line:
+			result.extend(line.split(':', 1)[1].split())
+	return result
+
+
+def read_ninja_deps(dn, ninja_fn):
+	# returns the dependencies recorded by ninja (deps = gcc) by output
+	result = {}
+	if not os.path.exists(os.path.join(dn, '.ninja_deps')):
+		return result
+	try:
+		output = _run_process(['ninja', '-C', dn, '-f', os.path.basename(ninja_fn), '-t', 'deps'])[0]
+	except ProcessError:
+		sys.stderr.write('Unable to read the dependencies recorded by ninja in %s\n' % dn)
+		return result
+	dep_list = []
+	for line in output.splitlines():
+		if line.startswith(' '):
+			dep_list.append(line.strip())
+		elif line.strip():
+			dep_list = result.setdefault(line.rsplit(': #deps', 1)[0], [])
+	return result
+
+
+def find_affected_targets(targets, changed_files, basedir, build_dn, ninja_fn):
+	# returns the targets that are (transitively) affected by the changed files
+	get_path = lambda dn, fn: os.path.normpath(os.path.join(dn, fn))
+	(consumers_by_fn, outputs_by_target) = ({}, {})
+	deps_by_output = read_ninja_deps(build_dn, ninja_fn)
+	for target in targets:
+		dep_list = list(map(lambda t: get_path(basedir, t.name), target.get_build_inputs() + target.get_build_deps()))
+		dep_list.extend(map(lambda fn: get_path(build_dn, fn), deps_by_output.get(target.name, [])))
+		depfile = dict(target.build_rule.params).get('depfile')
+		if depfile:
+			depfile = get_path(build_dn, depfile.replace('$out', target.name))
+			if os.path.exists(depfile):
+				dep_list.extend(map(lambda fn: get_path(build_dn, fn), read_depfile(depfile)))
+		for fn in dep_list:
+			consumers_by_fn.setdefault(fn, []).append(target)
+		outputs_by_target[target] = list(map(lambda fn: get_path(basedir, fn), [target.name] + target.get_implicit_outputs()))
+	(result, fn_list) = (set(), list(map(os.path.normpath, changed_files)))
+	while fn_list:
+		for target in consumers_by_fn.get(fn_list.pop(), []):
+			if target not in result:
+				result.add(target)
+				fn_list.extend(outputs_by_target[target])
+	return list(filter(lambda t: t.build_rule is not phony_rule, sorted(result, key = lambda t: t.name)))
+
+################################################################################
+# Resident watch mode
+################################################################################
+
+class InotifyWatcher(object):
+	(IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE) =\
+		(0x2, 0x4, 0x8, 0x40, 0x80, 0x100, 0x200)
+	IN_LISTING = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+	def __init__(self):
+		import ctypes, ctypes.util
+		self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno = True)
+		self._fd = self._libc.inotify_init()
+		if self._fd < 0:
+			raise OSError(ctypes.get_errno(), 'Unable to initialize inotify')
+		self._dn_by_wd = {}
+
+	def watch(self, dn):
+		mask = InotifyWatcher.IN_LISTING | InotifyWatcher.IN_MODIFY | InotifyWatcher.IN_ATTRIB | InotifyWatcher.IN_CLOSE_WRITE
+		wd = self._libc.inotify_add_watch(self._fd, dn.encode('utf-8'), mask)
+		if wd >= 0:
+			self._dn_by_wd[wd] = dn
+
+	def read_events(self, timeout = None):
+		import select, struct
+		result = []
+		while select.select([self._fd], [], [], timeout)[0]:
+			data = os.read(self._fd, 65536)
+			while data:
+				(wd, mask, cookie, name_len) = struct.unpack('iIII', data[:16])
+				name = data[16:16 + name_len].rstrip(b'\0').decode('utf-8')
+				data = data[16 + name_len:]
+				if wd in self._dn_by_wd:
+					result.append((self._dn_by_wd[wd], name, mask))
+			timeout = 0.02 # collect the events of a single save operation
+		return result
+
+
+class PollingWatcher(object):
+	def __init__(self, poll_interval = 0.5):
+		(self._poll_interval, self._dirs) = (poll_interval, set())
+
+	def watch(self, dn):
+		self._dirs.add(dn)
+
+	def _get_snapshot(self):
+		result = {}
+		for dn in self._dirs:
+			try:
+				for fn in os.listdir(dn):
+					try:
+						result[(dn, fn)] = os.stat(os.path.join(dn, fn)).st_mtime
+					except OSError:
+						continue
+			except OSError:
+				continue
+		return result
+
+	def read_events(self, timeout = None):
+		import time
+		snapshot = self._get_snapshot()
+		while True:
+			time.sleep(self._poll_interval)
+			snapshot_new = self._get_snapshot()
+			if snapshot_new != snapshot:
+				break
+		result = []
+		for key in set(snapshot).union(snapshot_new):
+			if key not in snapshot_new:
+				result.append(key + (InotifyWatcher.IN_DELETE,))
+			elif key not in snapshot:
+				result.append(key + (InotifyWatcher.IN_CREATE,))
+			elif snapshot[key] != snapshot_new[key]:
+				result.append(key + (InotifyWatcher.IN_MODIFY,))
+		return result
+
+
+def get_changed_dirs(events, generation_cache):
+	# returns the directories with changed listings - or None if no relevant change happened
+	(result, relevant) = (set(), False)
+	for (dn, fn, mask) in events:
+		fn = os.path.join(dn, fn)
+		if (fn in generation_cache.outputs) or os.path.basename(fn).startswith('.'):
+			continue
+		if fn in generation_cache.build_files:
+			relevant = True
+		if (dn in generation_cache.dirs) and (mask & InotifyWatcher.IN_LISTING):
+			result.add(dn)
+			relevant = True
+	if relevant:
+		return result
+
+
+def watch_build_file(bfn, ofn, mode, **kwargs):
+	import time
+	generation_cache = GenerationCache()
+	try:
+		watcher = InotifyWatcher()
+	except Exception:
+		sys.stderr.write('inotify is not available - using polling to detect changes\n')
+		watcher = PollingWatcher()
+	while True:
+		t_start = time.time()
+		(generation_cache.build_files, generation_cache.dirs) = (set(), set())
+		try:
+			generate_build_file(bfn, ofn, mode, cache = generation_cache, **kwargs)
+			sys.stderr.write('build file generated in %.1f ms\n' % ((time.time() - t_start) * 1000))
+		except BuildFileError: # errors in the build file are already reported
+			pass
+		except Exception:
+			import traceback
+			traceback.print_exc()
+		for dn in generation_cache.dirs.union(map(os.path.dirname, generation_cache.build_files)):
+			watcher.watch(dn)
+		changed_dirs = None
+		while changed_dirs is None:
+			changed_dirs = get_changed_dirs(watcher.read_events(), generation_cache)
+		for dn in changed_dirs:
+			generation_cache.listings.pop(dn, None)
 
 ################################################################################
 # Version support